@@ -0,0 +1,138 @@
+"""
+Generates reproducible synthetic instrument data for benchmarking the scripts.
+
+Datasets:
+    timeseries  High frequency multi-channel time series, as sliced by
+                csv_slicer.py
+    campbell    Campbell Scientific style file mixing several message types
+                with different column counts, secondary delimiters and NMEA
+                checksums, as partitioned by csv_partition.py
+    hour24      Time series whose midnight rows are recorded as 24:00 of the
+                previous day, as converted by csv_convert_date.py
+    overlapping A set of sorted time series files whose time ranges overlap,
+                as merged by csv_merge.py
+
+Example: python benchmarks/generate.py timeseries 1000000 data/timeseries.csv
+"""
+import os
+import argparse
+import numpy as np
+import pandas as pd
+
+SEED = 20210101
+
+def timeseries(rows, path, channels=8, frequency="1S", start="2021-01-01"):
+    rng = np.random.default_rng(SEED)
+    index = pd.date_range(start, periods=rows, freq=frequency)
+
+    df = pd.DataFrame(
+        rng.normal(10.0, 2.0, size=(rows, channels)).round(4),
+        columns=["channel_%d" % (channel) for channel in range(channels)],
+    )
+    df.insert(0, "timestamp", index.strftime("%Y-%m-%d %H:%M:%S"))
+    df["flag"] = rng.integers(0, 4, size=rows)
+
+    df.to_csv(path, index=False)
+
+    return [path]
+
+def campbell(rows, path):
+    rng = np.random.default_rng(SEED)
+
+    # Message types and the number of values each one carries
+    message_types = np.array([101, 102, 103, 104])
+    value_counts = {101: 3, 102: 6, 103: 4, 104: 8}
+
+    messages = rng.choice(message_types, size=rows)
+    values = rng.uniform(0, 100, size=(rows, max(value_counts.values())))
+
+    with open(path, "w") as source:
+        for row_number, (message, row_values) in enumerate(zip(messages, values)):
+            fields = ["%.4f" % (value) for value in row_values[:value_counts[message]]]
+
+            # Some messages use a secondary delimiter and carry a checksum
+            if message == 104:
+                source.write("%d,2021,%d&%s*4F\n" % (message, row_number, "&".join(fields)))
+            else:
+                source.write("%d,2021,%d,%s\n" % (message, row_number, ",".join(fields)))
+
+    return [path]
+
+def hour24(rows, path, frequency="10min"):
+    rng = np.random.default_rng(SEED)
+    index = pd.date_range("2021-01-01 00:10", periods=rows, freq=frequency)
+
+    timestamps = pd.Series(index.strftime("%Y-%m-%d %H:%M"))
+
+    # Loggers record midnight as 24:00 of the previous day
+    midnight = index.hour == 0
+    midnight &= index.minute == 0
+    timestamps[midnight] = (index[midnight] - pd.Timedelta(days=1)).strftime("%Y-%m-%d 24:00")
+
+    df = pd.DataFrame({
+        "timestamp": timestamps,
+        "value": rng.normal(10.0, 2.0, size=rows).round(4),
+    })
+    df.to_csv(path, index=False)
+
+    return [path]
+
+def overlapping(rows, path, files=8, overlap=0.1):
+    rng = np.random.default_rng(SEED)
+    index = pd.date_range("2021-01-01", periods=rows, freq="1S")
+
+    df = pd.DataFrame({
+        "timestamp": index.strftime("%Y-%m-%dT%H:%M:%S"),
+        "value": rng.normal(10.0, 2.0, size=rows).round(4),
+        "flag": rng.integers(0, 4, size=rows),
+    })
+
+    # Each file also holds the start of the next file's rows
+    base, extension = os.path.splitext(path)
+    file_rows = max(1, rows // files)
+    paths = []
+
+    for file_number in range(files):
+        start = file_number * file_rows
+        end = min(rows, start + file_rows + int(file_rows * overlap))
+
+        file_path = "%s_%02d%s" % (base, file_number, extension)
+        df.iloc[start:end].to_csv(file_path, index=False)
+        paths.append(file_path)
+
+    return paths
+
+DATASETS = {
+    "timeseries": timeseries,
+    "campbell": campbell,
+    "hour24": hour24,
+    "overlapping": overlapping,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "dataset",
+        help="Kind of data to generate",
+        choices=sorted(DATASETS),
+        action="store",
+    )
+
+    parser.add_argument(
+        "rows",
+        help="Number of rows to generate",
+        type=int,
+        action="store",
+    )
+
+    parser.add_argument(
+        "path",
+        help="Path of the generated file, datasets made up of several files number them after the file name",
+        action="store",
+    )
+
+    prog_args = parser.parse_args()
+
+    for generated_path in DATASETS[prog_args.dataset](prog_args.rows, prog_args.path):
+        print(generated_path)
@@ -0,0 +1,298 @@
+"""
+Benchmarks the scripts against synthetic instrument data.
+
+Each case runs one of the scripts, exactly as it would be run from the command
+line, against data generated by generate.py for every requested size.  The
+wall time, throughput (rows and MB of input per second) and peak resident
+memory of the script's process are recorded.  Results can be saved as a
+baseline and later runs compared against it, the exit status is non-zero when
+a case got slower or used more memory than the baseline allows.
+
+Example:
+    python benchmarks/run.py --sizes 100000 1000000 --save-baseline baseline.json
+    python benchmarks/run.py --sizes 100000 1000000 --baseline baseline.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from pathlib import Path
+
+import pandas as pd
+
+from generate import DATASETS
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# {source} is the generated source file (or all of them for datasets made up
+# of several files) and {output} a fresh output directory for every run
+CASES = {
+    "slicer": {
+        "script": "csv_slicer.py",
+        "dataset": "timeseries",
+        "args": ["{source}", "-o", "{output}", "-f", "%Y%m%d.csv", "-m", "date:%Y%m%d"],
+    },
+    "slicer_chunked": {
+        "script": "csv_slicer.py",
+        "dataset": "timeseries",
+        "args": ["{source}", "-o", "{output}", "-f", "%Y%m%d.csv", "-m", "date:%Y%m%d", "--chunksize", "100000"],
+    },
+    "partition": {
+        "script": "csv_partition.py",
+        "dataset": "campbell",
+        "args": ["{source}", "-o", "{output}", "-c", "0", "-n", "-s", "&"],
+    },
+    "partition_stream": {
+        "script": "csv_partition.py",
+        "dataset": "campbell",
+        "args": ["{source}", "-o", "{output}", "-c", "0", "-n", "-s", "&", "--stream"],
+    },
+    "convert_date": {
+        "script": "csv_convert_date.py",
+        "dataset": "hour24",
+        "args": ["{source}", "-o", "{output}", "-f", "converted.csv", "-c", "timestamp", "-t", "false", "-i", "%Y-%m-%d %H:%M"],
+    },
+    "merge": {
+        "script": "csv_merge.py",
+        "dataset": "overlapping",
+        "args": ["{source}", "-o", "{output}/merged.csv"],
+    },
+    "merge_presorted": {
+        "script": "csv_merge.py",
+        "dataset": "overlapping",
+        "args": ["{source}", "-o", "{output}/merged.csv", "--presorted"],
+    },
+}
+
+def main(prog_args):
+    work_dir = Path(prog_args.work_dir or tempfile.mkdtemp(prefix="csv_slicer_bench_"))
+    work_dir.mkdir(parents=True, exist_ok=True)
+
+    results = []
+
+    try:
+        for size in prog_args.sizes:
+            for case_name in prog_args.cases:
+                result = run_case(prog_args, case_name, size, work_dir)
+                results.append(result)
+
+                print("%-18s %10d rows  %8.3f s  %12.0f rows/s  %8.2f MB/s  %8.1f MB peak RSS" % (
+                    case_name, size, result["wall_seconds"], result["rows_per_second"],
+                    result["mb_per_second"], result["peak_rss_mb"],
+                ))
+    finally:
+        if not prog_args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+
+    if prog_args.output:
+        write_report(prog_args.output, report)
+
+    if prog_args.save_baseline:
+        write_report(prog_args.save_baseline, report)
+
+    if prog_args.baseline:
+        with open(prog_args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+        if compare(report, baseline, prog_args.tolerance):
+            sys.exit(1)
+
+def run_case(prog_args, case_name, size, work_dir):
+    case = CASES[case_name]
+    sources = generate_dataset(case["dataset"], size, work_dir)
+
+    args = []
+    for arg in case["args"]:
+        if arg == "{source}":
+            args.extend(sources)
+        else:
+            args.append(arg)
+
+    wall_times = []
+    peak_rss = 0
+
+    for _ in range(prog_args.repeat):
+        output_dir = work_dir / "output" / case_name
+        shutil.rmtree(output_dir, ignore_errors=True)
+        output_dir.mkdir(parents=True)
+
+        run_args = [arg.replace("{output}", str(output_dir)) for arg in args]
+        wall_time, rss = run_script(case["script"], run_args)
+
+        wall_times.append(wall_time)
+        peak_rss = max(peak_rss, rss)
+
+    # The fastest run is the least disturbed by everything else on the machine
+    wall_time = min(wall_times)
+    input_bytes = sum(os.path.getsize(source) for source in sources)
+
+    return {
+        "case": case_name,
+        "script": case["script"],
+        "size": size,
+        "input_bytes": input_bytes,
+        "wall_seconds": wall_time,
+        "rows_per_second": size / wall_time,
+        "mb_per_second": input_bytes / wall_time / 1e6,
+        "peak_rss_mb": peak_rss / 1e6,
+    }
+
+# Generated data is kept in the work directory and reused by every case and
+# repeat that needs it
+def generate_dataset(dataset, size, work_dir):
+    data_dir = work_dir / "data" / ("%s_%d" % (dataset, size))
+    manifest = data_dir / "manifest.json"
+
+    if manifest.exists():
+        with open(manifest) as manifest_file:
+            return json.load(manifest_file)
+
+    data_dir.mkdir(parents=True, exist_ok=True)
+    sources = DATASETS[dataset](size, str(data_dir / ("%s.csv" % (dataset))))
+
+    with open(manifest, "w") as manifest_file:
+        json.dump(sources, manifest_file)
+
+    return sources
+
+# Run a script in its own process, returns the wall time in seconds and the
+# peak resident memory of the process in bytes
+def run_script(script, args):
+    command = [sys.executable, str(REPO_DIR / script)] + args
+
+    # Error output goes to a temporary file rather than a pipe, nothing reads
+    # a pipe while waiting so a script writing more than the pipe holds would
+    # block forever
+    with tempfile.TemporaryFile() as errors:
+        start_time = time.perf_counter()
+        process = subprocess.Popen(command, cwd=REPO_DIR, stdout=subprocess.DEVNULL, stderr=errors)
+
+        # wait4() reports the resources used by this one child process
+        _, status, rusage = os.wait4(process.pid, 0)
+        wall_time = time.perf_counter() - start_time
+
+        process.returncode = os.waitstatus_to_exitcode(status)
+
+        if process.returncode != 0:
+            errors.seek(0)
+            raise RuntimeError("%s failed:\n%s" % (" ".join(command), errors.read().decode()))
+
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak_rss = rusage.ru_maxrss
+    if sys.platform != "darwin":
+        peak_rss *= 1024
+
+    return wall_time, peak_rss
+
+def write_report(path, report):
+    with open(path, "w") as report_file:
+        json.dump(report, report_file, indent=2)
+
+# Print how every case compares to the baseline, returns True if any of them
+# regressed by more than the tolerance
+def compare(report, baseline, tolerance):
+    baseline_results = {
+        (result["case"], result["size"]): result for result in baseline["results"]
+    }
+
+    regressed = False
+
+    print("\nCompared to baseline (pandas %s):" % (baseline.get("pandas")))
+
+    for result in report["results"]:
+        previous = baseline_results.get((result["case"], result["size"]))
+        if previous is None:
+            print("%-18s %10d rows  no baseline" % (result["case"], result["size"]))
+            continue
+
+        time_ratio = result["wall_seconds"] / previous["wall_seconds"]
+        rss_ratio = result["peak_rss_mb"] / previous["peak_rss_mb"]
+
+        status = "ok"
+        if time_ratio > 1 + tolerance or rss_ratio > 1 + tolerance:
+            status = "REGRESSION"
+            regressed = True
+
+        print("%-18s %10d rows  time x%.2f  peak RSS x%.2f  %s" % (
+            result["case"], result["size"], time_ratio, rss_ratio, status,
+        ))
+
+    return regressed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "--cases",
+        help="Benchmark cases to run, default: all of them",
+        choices=list(CASES),
+        default=list(CASES),
+        nargs="+",
+        action="store",
+    )
+
+    parser.add_argument(
+        "--sizes",
+        help="Number of rows of generated data to run each case against, default: 100000",
+        type=int,
+        default=[100000],
+        nargs="+",
+        action="store",
+    )
+
+    parser.add_argument(
+        "--repeat",
+        help="Number of times each case is run, the fastest run is reported, default: 3",
+        type=int,
+        default=3,
+        action="store",
+    )
+
+    parser.add_argument(
+        "--work-dir",
+        help="Directory for generated data and output files, kept between runs so data is only generated once.  Default: a temporary directory that is removed afterwards",
+        action="store",
+    )
+
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Write the results to this JSON file",
+        action="store",
+    )
+
+    parser.add_argument(
+        "--save-baseline",
+        help="Write the results to this JSON file to compare later runs against",
+        action="store",
+    )
+
+    parser.add_argument(
+        "--baseline",
+        help="Compare the results against a baseline saved with --save-baseline",
+        action="store",
+    )
+
+    parser.add_argument(
+        "--tolerance",
+        help="Fraction by which a case may be slower or use more memory than the baseline before it's reported as a regression, default: 0.2",
+        type=float,
+        default=0.2,
+        action="store",
+    )
+
+    prog_args = parser.parse_args()
+
+    main(prog_args)
@@ -0,0 +1,41 @@
+"""
+Column type inference shared by csv_slicer.py and csv_merge.py.
+
+Files read in batches of rows (--chunksize, --shard-size, --run-size) would
+otherwise have the types of their columns inferred for each batch on its own,
+an integer column with a blank in one batch is read as floats there and
+written out as 1.0 rather than 1.  The dtypes seen in every batch are
+collected in a first pass and combined into the types loading all the rows at
+once would have given the columns.
+"""
+import numpy as np
+
+# Add the (column, dtype) pairs of a batch to the dtypes seen for each column
+def add_dtypes(seen_dtypes, batch_dtypes):
+    for column, dtype in batch_dtypes:
+        seen_dtypes.setdefault(column, set()).add(dtype)
+
+    return seen_dtypes
+
+# Add the dtypes seen for each column of another file or part of one
+def merge_seen_dtypes(seen_dtypes, other_dtypes):
+    for column, dtypes in other_dtypes.items():
+        seen_dtypes.setdefault(column, set()).update(dtypes)
+
+    return seen_dtypes
+
+# One dtype for every column from the dtypes seen for it
+def combine_seen_dtypes(seen_dtypes):
+    return {column: combine_dtypes(dtypes) for column, dtypes in seen_dtypes.items()}
+
+# Integers with blanks in some batch (read as floats there) become floats
+# everywhere, columns that are numbers in some batches and text in others are
+# kept as text
+def combine_dtypes(dtypes):
+    if len(dtypes) == 1:
+        return next(iter(dtypes))
+
+    if all(dtype.kind in 'iuf' for dtype in dtypes):
+        return np.dtype('float64')
+
+    return np.dtype(object)
@@ -1,11 +1,11 @@
-from datetime import timedelta, datetime
-import re
+from datetime import timedelta
 import os
 import json
 from json import JSONDecodeError
 import pandas as pd
 import argparse
 from pathlib import Path
+from timestamps import adjust_index
 
 def main(prog_args):
     file_source = prog_args.source_file.strip()
@@ -16,6 +16,12 @@ def main(prog_args):
         process_source_file(prog_args, source_file)
 
 def process_source_file(prog_args, source_file):
+    csv_data = convert_data(prog_args, read_source(prog_args, source_file))
+
+    # Write files out in perscribed format
+    write_files(prog_args, csv_data)
+
+def read_source(prog_args, source_file):
     # Check if headers and data begins at a set row
     try:
         skip_rows = int(prog_args.data_begins)
@@ -39,11 +45,9 @@ def process_source_file(prog_args, source_file):
         print(ex)
         parse_dates_arg = prog_args.timestamp.strip().lower() == 'true'
 
-    index_col = prog_args.column.strip()
-
     # Open source file using provided source path, header row number and skip 
     # rows arguments
-    csv_data = pd.read_csv(
+    return pd.read_csv(
         filepath_or_buffer=source_file,
         header=header_row,
         skiprows=skip_rows,
@@ -52,52 +56,56 @@ def process_source_file(prog_args, source_file):
         keep_date_col=True
     )
 
-    csv_data[index_col] = csv_data[index_col].map(lambda date_str: parse_dates(date_str, prog_args))
+# Parse the timestamp column of the data, adjusting timezones if requested, 
+# and drop unwanted columns
+def convert_data(prog_args, csv_data):
+    index_col = prog_args.column.strip()
+
+    csv_data[index_col] = parse_date_column(csv_data[index_col], prog_args)
 
     if prog_args.adjust_tz: # if datetime is not UTC adjust accordingly
-        adjust_tz, destination_tz = prog_args.adjust_tz.strip().split(":")
-        
-        csv_data[index_col] = pd.to_datetime(csv_data[index_col]) + timedelta(hours=float(adjust_tz))
-                
         # set index, necessary grouping rows by interval format
         csv_data.set_index(index_col, inplace=True)
 
-        csv_data.index = csv_data.index.tz_localize(destination_tz)
+        csv_data.index = adjust_index(csv_data.index, prog_args.adjust_tz)
 
     if prog_args.drop_columns:
         csv_data.drop(labels=prog_args.drop_columns.strip().split(","), axis=1, inplace=True)
 
-    # Write files out in perscribed format
-    write_files(prog_args, csv_data)
+    return csv_data
 
-def parse_dates(date_str, prog_args):
-    new_dt = None
+def parse_date_column(date_strs, prog_args):
     parse_format = prog_args.in_format.strip()
 
-    try:
-        new_dt = datetime.strptime(date_str, parse_format)
-    except ValueError:
-        # Correct for 2400 time, which is actually 12AM the next day
-        print("Invalid Date/time string and parsing format: %s | %s" % (date_str, parse_format))
-        
-        find_time = None
-        replace_time = None
+    # Parse the whole column in one pass, anything that doesn't match the 
+    # format is left as NaT and dealt with below
+    new_dts = pd.to_datetime(date_strs, format=parse_format, errors='coerce')
+
+    failed = new_dts.isna() & date_strs.notna()
+    if not failed.any():
+        return new_dts
+
+    # Correct for 2400 time, which is actually 12AM the next day.  There are 
+    # two common ways that this problematic time may be represented.
+    failed_strs = date_strs[failed].astype(str)
+
+    find_2400 = failed_strs.str.contains('2400', regex=False)
+    find_24_00 = ~find_2400 & failed_strs.str.contains('24:00', regex=False)
 
-        # Two common ways that this problematic time may be represented
-        if date_str.find('2400') > -1:
-            find_time = '2400'
-            replace_time = '0000'
-        elif date_str.find('24:00') > -1:
-            find_time = '24:00'
-            replace_time = '00:00'
+    failed_strs[find_2400] = failed_strs[find_2400].str.replace('2400', '0000', regex=False)
+    failed_strs[find_24_00] = failed_strs[find_24_00].str.replace('24:00', '00:00', regex=False)
 
-        date_str = re.sub(find_time, replace_time, date_str)
-        new_dt = datetime.strptime(date_str, parse_format)
-        new_dt = new_dt + timedelta(days=1)
+    corrected_dts = pd.to_datetime(failed_strs, format=parse_format, errors='coerce') + timedelta(days=1)
 
-        print("Auto-correcting for unparsable time: %s" % (new_dt))
+    if corrected_dts.isna().any():
+        invalid_str = date_strs[failed][corrected_dts.isna()].iloc[0]
+        raise ValueError("Invalid Date/time string and parsing format: %s | %s" % (invalid_str, parse_format))
 
-    return new_dt
+    print("Auto-correcting for unparsable time in %d rows" % (len(corrected_dts)))
+
+    new_dts[failed] = corrected_dts
+
+    return new_dts
 
 def write_files(prog_args, csv_data):
     print(csv_data.info())
@@ -116,7 +124,9 @@ def write_files(prog_args, csv_data):
 
     csv_data.to_csv(file_path, index=write_index)
 
-if __name__ == "__main__":
+# Command line options, pipeline.py builds the options of its stages from 
+# these as well
+def build_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "source_file",
@@ -209,6 +219,9 @@ if __name__ == "__main__":
         action="store",
     )
 
-    prog_args = parser.parse_args()
+    return parser
+
+if __name__ == "__main__":
+    prog_args = build_parser().parse_args()
 
     main(prog_args)
@@ -7,11 +7,26 @@ python date/time string formatting.
 Can take in multiple files directly named or paths with wildcards.
 """
 import os
+import csv
+import heapq
+import shutil
+import tempfile
+import time
+import sys
+import json
 from numpy.lib.utils import source
 import pandas as pd
 from datetime import datetime
 import argparse
 from pathlib import Path
+from itertools import chain, islice
+from operator import itemgetter
+from contextlib import ExitStack
+from column_types import add_dtypes, combine_seen_dtypes
+from dedup_index import hash_keys, load_keys, write_keys, append_keys, contains_keys
+
+# Rows of the merged source files checked against the dedup index at a time
+DEDUP_BATCH_ROWS = 100000
 
 def main(prog_args):
     file_list = []
@@ -28,34 +43,123 @@ def main(prog_args):
 
     print("files to merge: %s" % (file_list))
 
-    merged_df = merge_files(prog_args, file_list)
-    output_merged_file(prog_args, merged_df)
+    metrics = MergeMetrics(prog_args.metrics)
+
+    output_path = output_file_path(prog_args)
+
+    if prog_args.dedup_index and Path(output_path).exists():
+        merge_into_indexed_file(prog_args, file_list, output_path, metrics)
+    else:
+        output_path = merge_to_file(prog_args, file_list, metrics)
+
+        if prog_args.dedup_index:
+            write_keys(output_path, column_keys(output_path))
+
+    metrics.finish(output_path)
+
+def merge_to_file(prog_args, file_list, metrics):
+    if prog_args.presorted:
+        return stream_merged_file(prog_args, file_list, metrics)
+
+    if prog_args.run_size:
+        return external_merge_files(prog_args, file_list, metrics)
+
+    merged_df = merge_files(prog_args, file_list, metrics)
+    output_path = output_merged_file(prog_args, merged_df)
+    metrics.rows_written = len(merged_df)
+
+    return output_path
 
-def merge_files(prog_args, file_list):
-    merged_df = pd.DataFrame()
+def merge_files(prog_args, file_list, metrics=None):
+    if metrics is None:
+        metrics = MergeMetrics()
+
+    source_dfs = []
 
     for source_file in file_list:
+        start_time = time.perf_counter()
         df = pd.read_csv(source_file)
 
-        if merged_df.empty:
-            merged_df = df
-        else:
-            df.columns = merged_df.columns
-            merged_df = merged_df.append(df, ignore_index=True)
-
-        print("\r\nSource DataFrame: %s" % (source_file))
-        print(df.info())
-        print(df.head())
-        print(df.tail())
-        print("\r\nMerged DataFrame:")
-        print(merged_df.info())
-        print(merged_df.head())
-        print(merged_df.tail())
+        # Headers from the first file are used for all of them
+        if source_dfs:
+            df.columns = source_dfs[0].columns
+
+        source_dfs.append(df)
+
+        metrics.file_read(source_file, len(df), time.perf_counter() - start_time)
+
+    return merge_frames(prog_args, source_dfs)
+
+# Combine DataFrames with the same column structure, sort them on the sort 
+# column and drop duplicates of the unique value column, which becomes the 
+# index
+def merge_frames(prog_args, source_dfs):
+    # Combine all the files at once, appending them one at a time copies 
+    # everything merged so far for every file
+    merged_df = pd.concat(source_dfs, ignore_index=True, sort=False)
 
     index_col = merged_df.columns[prog_args.column]
 
+    sort_col_idx, ascending = parse_sort(prog_args)
+    sort_col = merged_df.columns[sort_col_idx]
+
+    # A stable sort keeps rows with the same value in the order they were 
+    # read, so the first of them is the one kept
+    merged_df = merged_df.sort_values(by=sort_col, ascending=ascending, kind="mergesort")
+
+    deduped_df = merged_df.drop_duplicates(subset=index_col)
+    deduped_df.set_index(index_col, inplace=True)
+
+    return deduped_df
+
+class MergeMetrics:
+    """
+    Collects per-file and overall statistics of a merge and writes them out as 
+    JSON lines, one object per event, for monitoring.  Nothing is written 
+    unless a metrics path was given ("-" writes to standard error).
+    """
+
+    def __init__(self, metrics_path=None):
+        self.metrics_path = metrics_path
+        self.enabled = bool(metrics_path)
+        self.start_time = time.perf_counter()
+        self.files = 0
+        self.rows_read = 0
+        self.rows_written = 0
+
+    def file_read(self, source_file, rows, seconds=None):
+        self.files += 1
+        self.rows_read += rows
+
+        self.emit(event="file", file=str(source_file), rows=rows, seconds=seconds)
+
+    def finish(self, output_path):
+        self.emit(
+            event="merge",
+            output=str(output_path),
+            files=self.files,
+            rows_read=self.rows_read,
+            rows_deduplicated=self.rows_read - self.rows_written,
+            rows_written=self.rows_written,
+            bytes_written=os.path.getsize(output_path),
+            seconds=time.perf_counter() - self.start_time,
+        )
+
+    def emit(self, **fields):
+        if not self.enabled:
+            return
+
+        line = json.dumps(fields) + "\n"
+
+        if self.metrics_path == "-":
+            sys.stderr.write(line)
+            sys.stderr.flush()
+        else:
+            with open(self.metrics_path, "a") as metrics_file:
+                metrics_file.write(line)
+
+def parse_sort(prog_args):
     sort_col_idx, sort_dir = prog_args.sort.split(",")
-    sort_col = merged_df.columns[int(sort_col_idx)]
 
     ascending = None
     if sort_dir.strip().upper() == 'ASC':
@@ -63,22 +167,336 @@ def merge_files(prog_args, file_list):
     elif sort_dir.strip().upper() == 'DESC':
         ascending = False
 
-    merged_df = merged_df.sort_values(by=sort_col, ascending=ascending)
+    return int(sort_col_idx), ascending
 
-    deduped_df = merged_df.drop_duplicates(subset=index_col)
-    deduped_df.set_index(index_col, inplace=True)
+# Merge files whose rows are already sorted on the sort column with a k-way 
+# merge, only the current row of each file is held in memory.  Rows are 
+# written out in order as they are merged and duplicates of the index column 
+# are dropped on the fly, keeping the first row (files earlier in the list 
+# win ties).  Values are copied through as text rather than re-formatted by 
+# pandas.  Whether the sort column holds numbers is worked out from the first 
+# rows unless it's known.
+def stream_merged_file(prog_args, file_list, metrics=None, report_files=True, numeric=None):
+    if metrics is None:
+        metrics = MergeMetrics()
 
-    return deduped_df
+    index_col = prog_args.column
+    sort_col, ascending = parse_sort(prog_args)
 
-def output_merged_file(prog_args, output_df):
+    with ExitStack() as stack:
+        readers = []
+        for source_file in file_list:
+            reader = csv.reader(stack.enter_context(open(source_file, newline="")))
+
+            # Headers from the first file are used for all of them
+            header = next(reader, None)
+            if not readers:
+                headers = header
+
+            readers.append(reader)
+
+        # Look at the first row to decide whether the sort column holds 
+        # numbers or text, then put the row back in front of its file
+        first_rows = [next(reader, None) for reader in readers]
+        if numeric is None:
+            numeric = is_numeric([row for row in first_rows if row], sort_col)
+
+        # Rows are counted as the merge consumes them, files are read 
+        # concurrently so there is no per-file time to report
+        file_rows = [0] * len(readers)
+
+        readers = [
+            count_rows(chain([row], reader), file_rows, position)
+            for position, (row, reader) in enumerate(zip(first_rows, readers)) if row
+        ]
+
+        sort_key = row_key(sort_col, numeric, ascending)
+        merged_rows = heapq.merge(*readers, key=sort_key, reverse=not ascending)
+
+        # Duplicates are next to each other when the index column is the sort 
+        # column, otherwise remember every index value seen
+        if index_col == sort_col:
+            merged_rows = drop_adjacent_duplicates(merged_rows, sort_key)
+        else:
+            merged_rows = drop_seen_duplicates(merged_rows, row_key(index_col, numeric=False))
+
+        output_path = output_file_path(prog_args)
+        rows_written = 0
+
+        with open(output_path, "w", newline="") as output_file:
+            writer = csv.writer(output_file, lineterminator=os.linesep)
+
+            # The index column is written first, same as set_index() does
+            writer.writerow(index_first(headers, index_col))
+            for row in merged_rows:
+                writer.writerow(index_first(row, index_col))
+                rows_written += 1
+
+    if report_files:
+        for source_file, rows in zip(file_list, file_rows):
+            metrics.file_read(source_file, rows)
+
+    metrics.rows_written = rows_written
+
+    return output_path
+
+def count_rows(rows, counts, position):
+    for row in rows:
+        counts[position] += 1
+        yield row
+
+# Merge files that don't fit in memory with an external sort.  The files are 
+# read in runs of at most run_size rows, each run is sorted and spilled to a 
+# temporary directory and the sorted runs are then merged with the streaming 
+# k-way merge, which also drops the duplicates.  Every run is read with the 
+# column types of all the files together, so values are written out the same 
+# way in every run.
+def external_merge_files(prog_args, file_list, metrics=None):
+    if metrics is None:
+        metrics = MergeMetrics()
+
+    sort_col, ascending = parse_sort(prog_args)
+    dtypes = infer_run_dtypes(prog_args, file_list)
+
+    with tempfile.TemporaryDirectory(prefix="csv_merge_", dir=prog_args.temp_dir) as run_dir:
+        run_files = []
+        headers = None
+
+        for source_file in file_list:
+            start_time = time.perf_counter()
+            rows = 0
+
+            for df in pd.read_csv(source_file, chunksize=prog_args.run_size, dtype=dtypes):
+                rows += len(df)
+
+                # Headers from the first file are used for all of them
+                if headers is None:
+                    headers = df.columns
+                else:
+                    df.columns = headers
+
+                # A stable sort keeps rows with the same value in the order 
+                # they were read, so the merge keeps the same row as a full 
+                # in-memory sort would
+                df = df.sort_values(by=headers[sort_col], ascending=ascending, kind="mergesort")
+
+                run_file = os.path.join(run_dir, "run_%06d.csv" % (len(run_files)))
+                df.to_csv(run_file, index=False)
+                run_files.append(run_file)
+
+            metrics.file_read(source_file, rows, time.perf_counter() - start_time)
+
+        # A run starting with a blank would otherwise make the sort column 
+        # look like text
+        numeric = dtypes[sort_col].kind in 'iuf'
+
+        return stream_merged_file(prog_args, run_files, metrics, report_files=False, numeric=numeric)
+
+# Dtypes of the columns of the source files, by position since the headers of 
+# the first file are used for all of them, as concatenating the whole files 
+# would give them.  Costs an extra pass over the files.
+def infer_run_dtypes(prog_args, file_list):
+    seen_dtypes = {}
+
+    for source_file in file_list:
+        for df in pd.read_csv(source_file, chunksize=prog_args.run_size):
+            add_dtypes(seen_dtypes, enumerate(df.dtypes))
+
+    return combine_seen_dtypes(seen_dtypes)
+
+# Merge the source files into an output file that already exists and has a 
+# dedup index.  The source files are merged on their own first, then the rows 
+# whose unique value the output file already holds are dropped by checking 
+# their keys against the index, without reading the output file.  When the 
+# remaining rows all sort after the last row of the output file they're 
+# appended to it, otherwise the two are merged in a streaming pass (rows of 
+# the output file win ties) and the index is rewritten.
+def merge_into_indexed_file(prog_args, file_list, output_path, metrics):
+    existing_keys = load_keys(output_path)
+    if existing_keys is None:
+        write_keys(output_path, column_keys(output_path))
+        existing_keys = load_keys(output_path)
+
+    with tempfile.TemporaryDirectory(prefix="csv_merge_", dir=prog_args.temp_dir) as merge_dir:
+        merged_path = merge_to_file(
+            argparse.Namespace(**{**vars(prog_args), 'output': os.path.join(merge_dir, "sources.csv")}),
+            file_list, metrics,
+        )
+
+        new_path = os.path.join(merge_dir, "new.csv")
+        new_keys, first_row = drop_indexed_rows(merged_path, new_path, existing_keys)
+
+        metrics.rows_written = len(new_keys)
+        if not len(new_keys):
+            return
+
+        # Merged files have the unique value column first, the other columns 
+        # follow in their original order
+        sort_col, ascending = parse_sort(prog_args)
+        if sort_col == prog_args.column:
+            sort_col = 0
+        elif sort_col < prog_args.column:
+            sort_col += 1
+
+        last_row = read_last_row(output_path)
+
+        if can_append(first_row, last_row, sort_col, ascending):
+            with open(output_path, "ab") as output_file, open(new_path, "rb") as new_file:
+                new_file.readline()
+                shutil.copyfileobj(new_file, output_file)
+
+            append_keys(output_path, new_keys)
+            return
+
+        # Merge in the layout of the merged files
+        output_args = argparse.Namespace(**{
+            **vars(prog_args),
+            'column': 0,
+            'sort': "%d,%s" % (sort_col, "ASC" if ascending else "DESC"),
+            'output': os.path.join(merge_dir, "merged.csv"),
+        })
+
+        rows_written = metrics.rows_written
+        os.replace(stream_merged_file(output_args, [output_path, new_path], metrics, report_files=False), output_path)
+        metrics.rows_written = rows_written
+
+    write_keys(output_path, column_keys(output_path))
+
+# Copy the rows of a merged file whose unique value (first column) isn't in 
+# the existing keys to another file, returns their keys and the first row 
+# copied
+def drop_indexed_rows(merged_path, new_path, existing_keys):
+    new_keys = []
+    first_row = None
+
+    with open(merged_path, newline="") as merged_file, open(new_path, "w", newline="") as new_file:
+        reader = csv.reader(merged_file)
+        writer = csv.writer(new_file, lineterminator=os.linesep)
+
+        writer.writerow(next(reader))
+
+        while True:
+            rows = list(islice(reader, DEDUP_BATCH_ROWS))
+            if not rows:
+                break
+
+            keys = hash_keys([row[0] for row in rows])
+            known = contains_keys(existing_keys, keys)
+
+            for row, key, is_known in zip(rows, keys, known):
+                if not is_known:
+                    if first_row is None:
+                        first_row = row
+
+                    writer.writerow(row)
+                    new_keys.append(key)
+
+    return new_keys, first_row
+
+# Dedup keys of the unique value column of a merged file, always the first
+def column_keys(merged_path):
+    values = pd.read_csv(merged_path, usecols=[0], dtype=str, keep_default_na=False).iloc[:, 0]
+
+    return hash_keys(values)
+
+# New rows can be appended when the first of them doesn't sort before the last 
+# row of the output file
+def can_append(first_row, last_row, sort_col, ascending):
+    if last_row is None:
+        return True
+
+    numeric = is_numeric([first_row, last_row], sort_col)
+    sort_key = row_key(sort_col, numeric, ascending)
+
+    if ascending:
+        return sort_key(first_row) >= sort_key(last_row)
+
+    return sort_key(first_row) <= sort_key(last_row)
+
+# Last row of a CSV file, None when it only has a header
+def read_last_row(file_path, block_size=4096):
+    with open(file_path, "rb") as csv_file:
+        position = csv_file.seek(0, os.SEEK_END)
+        data = b""
+
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+
+            csv_file.seek(position)
+            data = csv_file.read(step) + data
+
+            if b"\n" in data.rstrip(b"\r\n"):
+                break
+
+    lines = data.rstrip(b"\r\n").split(b"\n")
+    if len(lines) < 2 and position == 0:
+        return None
+
+    return next(csv.reader([lines[-1].decode()]), None)
+
+def is_numeric(rows, column):
+    try:
+        for row in rows:
+            float(row[column])
+    except (ValueError, IndexError):
+        return False
+
+    return True
+
+# Key used to compare rows on a column, missing or non-numeric values in a 
+# numeric column sort after everything else in either direction, the same as 
+# sort_values() does
+def row_key(column, numeric, ascending=True):
+    if not numeric:
+        return itemgetter(column)
+
+    missing = (1, 0.0) if ascending else (-1, 0.0)
+
+    def numeric_key(row):
+        try:
+            return (0, float(row[column]))
+        except (ValueError, IndexError):
+            return missing
+
+    return numeric_key
+
+def drop_adjacent_duplicates(rows, key):
+    last_key = None
+
+    for row in rows:
+        value = key(row)
+        if value != last_key:
+            last_key = value
+            yield row
+
+def drop_seen_duplicates(rows, key):
+    seen = set()
+
+    for row in rows:
+        value = key(row)
+        if value not in seen:
+            seen.add(value)
+            yield row
+
+def index_first(row, index_col):
+    return [row[index_col]] + row[:index_col] + row[index_col + 1:]
+
+def output_file_path(prog_args):
     try:
-        output_file_path = datetime.now().strftime(prog_args.output.strip())
+        return datetime.now().strftime(prog_args.output.strip())
     except:
-        output_file_path = prog_args.output.strip()
+        return prog_args.output.strip()
 
-    output_df.to_csv(output_file_path)
+def output_merged_file(prog_args, output_df):
+    output_path = output_file_path(prog_args)
+    output_df.to_csv(output_path)
 
-if __name__ == '__main__':
+    return output_path
+
+# Command line options, pipeline.py builds the options of its stages from 
+# these as well
+def build_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -105,6 +523,37 @@ if __name__ == '__main__':
         action="store",
     )
 
+    parser.add_argument(
+        "--presorted",
+        help="The source files are already sorted on the sort column, merge them in a single streaming pass instead of loading them all into memory.  Duplicates are dropped as rows are merged, when the unique value column differs from the sort column every unique value seen is kept in memory.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--run-size",
+        help="Merge files that don't fit in memory with an external sort.  Files are read in runs of at most this many rows, each run is sorted and written to a temporary directory and the runs are then merged in a single streaming pass.  Column types are worked out over all the files first, the same as when they're sorted in memory, which takes one extra pass over them.  Default: None (sort in memory)",
+        type=int,
+        action="store",
+    )
+
+    parser.add_argument(
+        "--temp-dir",
+        help="Directory for the sorted runs of --run-size and the temporary files of --dedup-index, default: the system temporary directory",
+        action="store",
+    )
+
+    parser.add_argument(
+        "--dedup-index",
+        help="Keep 64-bit hashes of the unique values of the output file in a sidecar file (<output file>.keys).  When the output file already exists the source files are merged into it: rows whose unique value it already holds are dropped without reading it, new rows that all sort after its last row are appended and only overlapping rows cause it to be merged and rewritten.  Use with an --output without date/time formatting.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--metrics",
+        help="Write per-file timings and row counts plus a summary of rows read, rows deduplicated and bytes written to this file as JSON lines, use - for standard error.  Default: None (disabled)",
+        action="store",
+    )
+
     parser.add_argument(
         "-o",
         "--output",
@@ -113,6 +562,9 @@ if __name__ == '__main__':
         action="store",
     )
 
-    prog_args = parser.parse_args()
+    return parser
+
+if __name__ == '__main__':
+    prog_args = build_parser().parse_args()
 
     main(prog_args)
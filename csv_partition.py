@@ -8,46 +8,86 @@ multiple kinds of messages, like Campbell Scientific CSV.
 """
 
 import os
+import io
+import re
+import csv
+import mmap
+import locale
 import argparse
 import pandas as pd
 import json
 from pathlib import Path
+from collections import OrderedDict
 
 def main(prog_args):
-    output_files = {}
-
-    source = open(prog_args.source_file.strip(), "r")
-    partition_column = prog_args.column
+    formats = parse_formats(prog_args)
+    labels = parse_labels(prog_args)
     
+    # Streaming mode, write each row out to its partition as soon as it has 
+    # been read so memory use doesn't grow with the size of the source file
+    if prog_args.stream:
+        stream_partitions(prog_args, scan_lines(prog_args, formats), labels)
+        return
+
+    with open(prog_args.source_file.strip(), "r") as source:
+        partitions = partition_frames(prog_args, source, formats, labels)
+
+    for partition, df in partitions.items():
+        output_path = "%s/%s.csv" % (prog_args.output.strip(), partition)
+
+        # check output path and create directory paths that do not exist
+        if not Path(os.path.dirname(output_path)).exists():
+            os.makedirs(os.path.dirname(output_path))
+
+        df.to_csv(output_path, index=False, header=bool(labels) and partition in labels)
+
+def parse_formats(prog_args):
     try:
-        formats = json.loads(prog_args.format.strip())
+        return json.loads(prog_args.format.strip())
     except AttributeError:
-        formats = {}
+        return {}
 
+def parse_labels(prog_args):
     try:
-        labels = json.loads(prog_args.labels)
+        return json.loads(prog_args.labels)
     except TypeError:
-        labels = {}
-    
+        return {}
 
-    for line in source:
-        # Separate NMEA Checksum from final value
-        if prog_args.nema_checksum:
-            print("Fixing NMEA checksum...")
-            line = line.replace("*", prog_args.delimiter + "*", 1)
+# Read the source into a DataFrame per partition, columns are named after the 
+# partition's labels when it has any.  Values are kept as the text they were 
+# split into.
+def partition_frames(prog_args, source, formats, labels):
+    output_files = {}
 
-        for sec_delimiter in prog_args.secondary_delimiters:
-            print(f"Processing secondary delimiter: {sec_delimiter}")
-            line = line.replace(sec_delimiter, prog_args.delimiter)
+    for column, row in parse_rows(prog_args, source, formats):
+        if column in output_files:
+            output_files[column].append(row)
+        else:
+            output_files[column] = []
+            output_files[column].append(row)
+
+    partitions = {}
+
+    for partition in output_files:
+        df = pd.DataFrame.from_dict(output_files[partition])
+
+        if labels and partition in labels:
+            df.columns = labels[partition].split(",")
 
-        row = line.strip().split(prog_args.delimiter)
+        partitions[partition] = df
 
-                    
-        # https://stackoverflow.com/questions/20003290/output-different-precision-by-column-with-pandas-dataframe-to-csv
-        for column, format_str in formats.items():
-            col_int = int(column)
-            row[col_int] = prep_value(value=row[col_int], format_str=format_str)
+    return partitions
 
+# Split each line of the source into a row of values and yield it along with 
+# the value of its partition column
+def parse_rows(prog_args, source, formats):
+    return split_rows(prog_args, source, build_line_parser(prog_args, formats))
+
+def split_rows(prog_args, lines, split_line):
+    partition_column = prog_args.column
+
+    for line in lines:
+        row = split_line(line)
 
         try:
             column = row[partition_column]
@@ -56,38 +96,305 @@ def main(prog_args):
             print(f"Line content: {row}")
             continue
 
-        if column in output_files:
-            output_files[column].append(row)
+        yield column, row
+
+# Build a function that turns a line of the source file into a row of values.  
+# Everything that depends only on the program arguments (delimiter 
+# replacement, column formatters) is worked out once here rather than for 
+# every line.
+def build_line_parser(prog_args, formats):
+    delimiter = prog_args.delimiter
+    nmea_checksum = prog_args.nema_checksum
+    sec_delimiters = prog_args.secondary_delimiters or []
+
+    # Separate NMEA Checksum from final value
+    if nmea_checksum:
+        print("Fixing NMEA checksums...")
+        checksum_delimiter = delimiter + "*"
+
+    # Secondary delimiters are all replaced in a single pass, with a 
+    # translation table when they're single characters or a regular 
+    # expression (longest delimiter first) when they aren't
+    replace_delimiters = None
+    if sec_delimiters:
+        print(f"Processing secondary delimiters: {' '.join(sec_delimiters)}")
+
+        if all(len(sec_delimiter) == 1 for sec_delimiter in sec_delimiters):
+            delimiter_table = str.maketrans(dict.fromkeys(sec_delimiters, delimiter))
+            replace_delimiters = lambda line: line.translate(delimiter_table)
         else:
-            output_files[column] = []
-            output_files[column].append(row)
+            delimiter_pattern = re.compile("|".join(
+                re.escape(sec_delimiter) for sec_delimiter in sorted(sec_delimiters, key=len, reverse=True)
+            ))
+            replace_delimiters = lambda line: delimiter_pattern.sub(delimiter, line)
 
-    source.close
+    # https://stackoverflow.com/questions/20003290/output-different-precision-by-column-with-pandas-dataframe-to-csv
+    formatters = [(int(column), build_formatter(format_str)) for column, format_str in formats.items()]
 
-    for partition in output_files:
-        output_path = "%s/%s.csv" % (prog_args.output.strip(), partition)
+    def split_line(line):
+        if nmea_checksum:
+            line = line.replace("*", checksum_delimiter, 1)
 
-        # check output path and create directory paths that do not exist
-        if not Path(os.path.dirname(output_path)).exists():
-            os.makedirs(os.path.dirname(output_path))
+        if replace_delimiters:
+            line = replace_delimiters(line)
 
-        df = pd.DataFrame.from_dict(output_files[partition])
+        row = line.strip().split(delimiter)
 
-        headers = False
-        if labels and partition in labels:
-            headers = labels[partition].split(",")
+        for col_int, formatter in formatters:
+            row[col_int] = formatter(row[col_int])
 
-        df.to_csv(output_path, index=False, header=headers)
+        return row
+
+    return split_line
+
+# Build a function that converts a value to the type of a single format and 
+# formats it, the value type is only looked up once
+def build_formatter(format_str):
+    output_format = format_str['output'].format
 
-def prep_value(value, format_str):
     if format_str['type'] == 'int':
-        value = int(value)
+        return lambda value: output_format(int(value))
     elif format_str['type'] == 'float':
-        value = float(value)
+        return lambda value: output_format(float(value))
 
-    return format_str['output'].format(value)
+    return output_format
 
-if __name__ == "__main__":
+# Scan the memory-mapped source file in blocks of whole lines, as bytes, and 
+# yield the lines of each partition in the block, ready to be written to the 
+# partition file.  Only the partition column's field is decoded, a line that 
+# the CSV writer would write out unchanged is copied straight from the source 
+# (with secondary delimiters and NMEA checksums replaced in place).  Any 
+# other line (quotes, lone carriage returns, surrounding whitespace, --format 
+# changes) is decoded and split as text.
+def scan_lines(prog_args, formats):
+    encoding = locale.getpreferredencoding(False)
+    split_line = build_line_parser(prog_args, formats)
+    transform_lines = build_lines_transform(prog_args, encoding)
+    format_row = build_row_formatter(encoding)
+
+    partition_column = prog_args.column
+    delimiter = prog_args.delimiter.encode(encoding)
+    line_end = os.linesep.encode(encoding)
+
+    # Lines can be copied when the delimiter can be swapped for a comma 
+    # without the fields needing to be quoted
+    unsafe_bytes = [b'"', b'\r'] + ([] if delimiter == b',' else [b','])
+    copy_lines = (
+        not formats and partition_column >= 0 and transform_lines is not None
+        and not any(unsafe in delimiter for unsafe in unsafe_bytes)
+    )
+
+    # str.strip() would take off more than ASCII whitespace, so copied lines 
+    # have to start and end with printable ASCII
+    edge_bytes = range(0x21, 0x7f)
+
+    with open(prog_args.source_file.strip(), "rb") as source:
+        if os.fstat(source.fileno()).st_size == 0:
+            return
+
+        with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            if hasattr(buffer, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                buffer.madvise(mmap.MADV_SEQUENTIAL)
+
+            for raw_block in read_blocks(buffer):
+                # Line ends are written as line_end anyway, so CRLF line ends 
+                # can be dropped as long as every carriage return is part of 
+                # one, the lines are then the same a text mode file reads.  
+                # Blocks with lone carriage returns are decoded line by line.
+                if b'\r' in raw_block:
+                    lf_block = raw_block.replace(b'\r\n', b'\n')
+                    if b'\r' not in lf_block:
+                        raw_block = lf_block
+
+                raw_lines = raw_block.split(b'\n')
+                if raw_block.endswith(b'\n'):
+                    raw_lines.pop()
+
+                lines = transform_lines(raw_lines) if copy_lines else raw_lines
+
+                # The replacements never add any of the unsafe bytes
+                check_lines = any(unsafe in raw_block for unsafe in unsafe_bytes)
+
+                # Lines of each partition in the block, by partition field
+                block_lines = {}
+
+                for line, raw_line in zip(lines, raw_lines):
+                    if copy_lines and line and line[0] in edge_bytes and line[-1] in edge_bytes and not (
+                        check_lines and any(unsafe in line for unsafe in unsafe_bytes)
+                    ):
+                        fields = line.split(delimiter, partition_column + 1)
+
+                        if len(fields) > partition_column:
+                            if delimiter != b',':
+                                line = line.replace(delimiter, b',')
+
+                            partition_lines = block_lines.get(fields[partition_column])
+                            if partition_lines is None:
+                                partition_lines = block_lines[fields[partition_column]] = []
+
+                            partition_lines.append(line)
+                            continue
+
+                    for partition, row in split_rows(prog_args, decode_lines(raw_line, encoding), split_line):
+                        block_lines.setdefault(partition.encode(encoding), []).append(format_row(row)[:-len(line_end)])
+
+                for field, partition_lines in block_lines.items():
+                    partition_lines.append(b'')
+                    yield field.decode(encoding), line_end.join(partition_lines)
+
+# Yield blocks of about block_size bytes from the buffer, ending at line ends
+def read_blocks(buffer, block_size=1024 * 1024):
+    position = 0
+    end = len(buffer)
+
+    while position < end:
+        block_end = end
+        if position + block_size < end:
+            newline = buffer.find(b'\n', position + block_size - 1)
+            if newline >= 0:
+                block_end = newline + 1
+
+        yield buffer[position:block_end]
+        position = block_end
+
+# Decode a line of the source into the lines a text mode file would have 
+# read, where a lone carriage return also ends a line
+def decode_lines(raw_line, encoding):
+    text = raw_line.decode(encoding)
+
+    if '\r' not in text:
+        return [text]
+
+    lines = text.replace('\r\n', '\n').replace('\r', '\n').split('\n')
+    if lines[-1] == '':
+        lines.pop()
+
+    return lines
+
+# Build a function that applies the NMEA checksum and secondary delimiter 
+# replacements of build_line_parser() to a list of lines as bytes, None when 
+# the delimiters contain line ends (which a text mode file would have split 
+# the line at first)
+def build_lines_transform(prog_args, encoding):
+    delimiter = prog_args.delimiter.encode(encoding)
+    sec_delimiters = [sec_delimiter.encode(encoding) for sec_delimiter in prog_args.secondary_delimiters or []]
+
+    if any(b'\n' in value or b'\r' in value for value in [delimiter] + sec_delimiters):
+        return None
+
+    checksum_delimiter = None
+    if prog_args.nema_checksum:
+        checksum_delimiter = delimiter + b"*"
+
+    # Secondary delimiters are replaced in the lines joined back together
+    replace_delimiters = None
+    if sec_delimiters:
+        if len(delimiter) == 1 and all(len(sec_delimiter) == 1 for sec_delimiter in sec_delimiters):
+            delimiter_table = bytes.maketrans(b"".join(sec_delimiters), delimiter * len(sec_delimiters))
+            replace_delimiters = lambda block: block.translate(delimiter_table)
+        else:
+            delimiter_pattern = re.compile(b"|".join(
+                re.escape(sec_delimiter) for sec_delimiter in sorted(sec_delimiters, key=len, reverse=True)
+            ))
+            replace_delimiters = lambda block: delimiter_pattern.sub(delimiter, block)
+
+    def transform_lines(lines):
+        if checksum_delimiter:
+            lines = [line.replace(b"*", checksum_delimiter, 1) for line in lines]
+
+        if replace_delimiters:
+            lines = replace_delimiters(b"\n".join(lines)).split(b"\n")
+
+        return lines
+
+    return transform_lines
+
+# Build a function that formats a row the way csv.writer writes it out, as 
+# bytes
+def build_row_formatter(encoding):
+    row_buffer = io.StringIO()
+    writer = csv.writer(row_buffer, lineterminator=os.linesep)
+
+    def format_row(row):
+        row_buffer.seek(0)
+        row_buffer.truncate()
+        writer.writerow(row)
+
+        return row_buffer.getvalue().encode(encoding)
+
+    return format_row
+
+# Write lines out to their partition files as they arrive.  Rows are written 
+# exactly as they were split, unlike the in-memory mode shorter rows are not 
+# padded out to the widest row of their partition.
+def stream_partitions(prog_args, lines, labels):
+    output_pool = OutputFilePool(prog_args.max_open_files)
+    format_row = build_row_formatter(locale.getpreferredencoding(False))
+
+    # Output paths of the partitions seen so far
+    output_paths = {}
+
+    try:
+        for partition, line in lines:
+            output_path = output_paths.get(partition)
+            if output_path is None:
+                output_path = output_paths[partition] = "%s/%s.csv" % (prog_args.output.strip(), partition)
+
+            output_file, created = output_pool.output_file(output_path)
+
+            if created and labels and partition in labels:
+                output_file.write(format_row(labels[partition].split(",")))
+
+            output_file.write(line)
+    finally:
+        output_pool.close()
+
+class OutputFilePool:
+    """
+    Keeps a bounded number of output files open for writing.  When another 
+    file needs to be opened the least recently used one is closed, and it's 
+    re-opened for appending the next time a line is written to it.
+    """
+
+    def __init__(self, max_open, buffer_size=64 * 1024):
+        self.max_open = max_open
+        self.buffer_size = buffer_size
+        self.open_files = OrderedDict()
+        self.created = set()
+
+    # Returns the output file (opened in binary mode) for the output path and 
+    # whether the file was just created by this call
+    def output_file(self, output_path):
+        if output_path in self.open_files:
+            self.open_files.move_to_end(output_path)
+            return self.open_files[output_path], False
+
+        if len(self.open_files) >= self.max_open:
+            _, output_file = self.open_files.popitem(last=False)
+            output_file.close()
+
+        created = output_path not in self.created
+        if created:
+            # check output path and create directory paths that do not exist
+            if not Path(os.path.dirname(output_path)).exists():
+                os.makedirs(os.path.dirname(output_path))
+
+            self.created.add(output_path)
+
+        output_file = open(output_path, "wb" if created else "ab", buffering=self.buffer_size)
+        self.open_files[output_path] = output_file
+
+        return output_file, created
+
+    def close(self):
+        for output_file in self.open_files.values():
+            output_file.close()
+
+        self.open_files.clear()
+
+# Command line options, pipeline.py builds the options of its stages from 
+# these as well
+def build_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -149,6 +456,20 @@ if __name__ == "__main__":
         action="store",
     )
 
+    parser.add_argument(
+        "--stream",
+        help="Write each row out to its partition file as soon as it has been read instead of holding the whole source file in memory.  The source file is memory-mapped and scanned as bytes, lines that need no changes besides the secondary delimiters and NMEA checksums are copied to their partition file as they are.  NOTE: Rows are written as they were split, shorter rows are not padded to the width of the widest row in their partition.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--max-open-files",
+        help="Maximum number of partition files kept open at once in streaming mode, the least recently used file is closed when another needs to be opened.  Default: 256",
+        default=256,
+        type=int,
+        action="store",
+    )
+
     parser.add_argument(
         "-d",
         "--delimiter",
@@ -157,6 +478,9 @@ if __name__ == "__main__":
         default=","
     )
 
-    prog_args = parser.parse_args()
+    return parser
+
+if __name__ == "__main__":
+    prog_args = build_parser().parse_args()
 
     main(prog_args)
@@ -1,19 +1,655 @@
-from datetime import timedelta
 import os
-import importlib
+import csv
+import json
 import pandas as pd
 import argparse
+from io import BytesIO
 from pathlib import Path
+from itertools import islice
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from methods import load_method, is_streaming
+from column_types import add_dtypes, merge_seen_dtypes, combine_seen_dtypes
+from dedup_index import index_keys, load_keys, write_keys, append_keys, contains_keys
+from ledger import SourceLedger
+from watcher import watch_directory
+from output_buffer import OutputBuffer
+from frame_transfer import pack_frame, unpack_frame, release_frame
+
+try:
+    from pandas.tseries.api import guess_datetime_format
+except ImportError:
+    from pandas._libs.tslibs.parsing import guess_datetime_format
+
+# Ledger of processed source files kept in the output directory by --watch
+LEDGER_FILENAME = '.csv_slicer_ledger.json'
+
+# Format of the timestamps in the source files matched by each source glob, 
+# guessed from the first file read so the others are parsed with it rather 
+# than inferring it again
+SOURCE_DATE_FORMATS = {}
 
 def main(prog_args):
     file_source = prog_args.source_file.strip()
     src_dir = os.path.dirname(file_source)
     file_path = os.path.basename(file_source)
 
-    for source_file in Path(src_dir).glob(file_path):
-        process_source_file(prog_args, source_file)
+    if prog_args.watch:
+        watch_sources(prog_args, src_dir, file_path)
+        return
+
+    source_files = Path(src_dir).glob(file_path)
+
+    if prog_args.checkpoint:
+        process_checkpointed(prog_args, source_files)
+        return
+
+    # Collect the rows for each output file from all the source files and 
+    # write every output file once at the end
+    output_buffer = None
+    if prog_args.buffer_outputs:
+        output_buffer = OutputBuffer(prog_args.buffer_memory * 1024 * 1024)
+
+    if prog_args.workers > 1 and prog_args.shard_size:
+        process_sharded(prog_args, source_files, output_buffer)
+    elif prog_args.workers > 1:
+        process_in_parallel(prog_args, source_files, output_buffer)
+    else:
+        for source_file in source_files:
+            process_source_file(prog_args, source_file, output_buffer)
+
+    if output_buffer is not None:
+        write_buffered(prog_args, output_buffer)
+
+# Parse and slice source files in a pool of worker processes.  The main process 
+# is the only one that ever writes output files and it writes the results of 
+# each source file in the same order as a serial run would, so concurrent 
+# merges into the same output file can't lose rows.
+def process_in_parallel(prog_args, source_files, output_buffer=None):
+    # Limit how many parsed source files can be waiting to be written
+    max_pending = 2 * prog_args.workers
+    pending = deque()
+
+    with ProcessPoolExecutor(max_workers=prog_args.workers) as executor:
+        for source_file in source_files:
+            pending.append(executor.submit(collect_slices, prog_args, source_file))
+
+            if len(pending) >= max_pending:
+                write_source_slices(prog_args, pending.popleft().result(), output_buffer=output_buffer)
+
+        while pending:
+            write_source_slices(prog_args, pending.popleft().result(), output_buffer=output_buffer)
+
+# Split each source file into byte ranges of about --shard-size MB, cut at line 
+# ends, and parse and slice the ranges in a pool of worker processes so a 
+# single large source file is spread over all of them.  The slices of each 
+# range are written by the main process in file order, the same way the 
+# batches read with --chunksize are.
+def process_sharded(prog_args, source_files, output_buffer=None):
+    with ProcessPoolExecutor(max_workers=prog_args.workers) as executor:
+        for source_file in source_files:
+            if split_whole_file(prog_args, source_file):
+                continue
+
+            # Close the slices right away on errors so the shared memory of 
+            # ranges that won't be written is freed
+            source_slices = sharded_slices(prog_args, executor, source_file)
+            try:
+                write_source_slices(prog_args, source_slices, output_buffer=output_buffer)
+            finally:
+                source_slices.close()
+
+# Yield the batches of slices of a source file as the workers finish parsing 
+# its byte ranges, in the order of the ranges.  The column types are worked 
+# out over all the ranges first, in the workers, so every range is formatted 
+# the same as when the file is loaded at once.
+def sharded_slices(prog_args, executor, source_file):
+    header_lines = data_start_line(parse_skip_rows(prog_args), parse_header_row(prog_args))
+    header, shards = shard_ranges(source_file, header_lines, prog_args.shard_size * 1024 * 1024)
+
+    # Rows skipped after the header only apply to the first range
+    shard_args = [
+        prog_args if start == len(header) else header_args(prog_args, header_lines) for start, end in shards
+    ]
+
+    dtype_futures = [
+        executor.submit(shard_dtypes, range_args, source_file, header, start, end)
+        for range_args, (start, end) in zip(shard_args, shards)
+    ]
+
+    seen_dtypes = {}
+    for future in dtype_futures:
+        merge_seen_dtypes(seen_dtypes, future.result())
+
+    dtypes = combine_seen_dtypes(seen_dtypes)
+
+    # Limit how many parsed ranges can be waiting to be written
+    max_pending = 2 * prog_args.workers
+    pending = deque()
+
+    try:
+        for range_args, (start, end) in zip(shard_args, shards):
+            pending.append(executor.submit(slice_shard, range_args, source_file, header, start, end, dtypes))
+
+            if len(pending) >= max_pending:
+                yield from unpack_slices(pending.popleft().result())
+
+        while pending:
+            yield from unpack_slices(pending.popleft().result())
+    finally:
+        release_pending(pending)
+
+# Read the header lines of a source file and split the rest of it into 
+# (start, end) byte ranges of about shard_size bytes that end at line ends
+def shard_ranges(source_file, header_lines, shard_size):
+    file_size = os.path.getsize(source_file)
+    shards = []
+
+    with open(source_file, 'rb') as source:
+        header = b''.join(islice(source, header_lines))
+
+        start = len(header)
+        while start < file_size:
+            end = start + max(shard_size, 1)
+
+            if end < file_size:
+                # Carry on to the end of the line the range stops in
+                source.seek(end - 1)
+                source.readline()
+                end = source.tell()
+
+            end = min(end, file_size)
+            shards.append((start, end))
+            start = end
+
+    return header, shards
+
+# Parse and slice one byte range of a source file in a worker process, with 
+# the header lines put back in front of it.  The slices are handed back packed 
+# in shared memory rather than pickled.
+def slice_shard(prog_args, source_file, header, start, end, dtypes=None):
+    shard = read_shard(source_file, start, end)
+
+    if not shard.strip():
+        return []
+
+    packed_batches = []
+
+    try:
+        for slices in slice_source_file(prog_args, BytesIO(header + shard), dtypes):
+            packed_slices = []
+            packed_batches.append(packed_slices)
+
+            for log_file, df_slice in slices:
+                packed_slices.append((log_file, pack_frame(df_slice)))
+    except BaseException:
+        release_batches(packed_batches)
+        raise
+
+    return packed_batches
+
+# Dtypes inferred for the columns of one byte range of a source file, read the 
+# same way slice_shard() reads it, in a worker process
+def shard_dtypes(prog_args, source_file, header, start, end):
+    shard = read_shard(source_file, start, end)
+
+    if not shard.strip():
+        return {}
+
+    read_args, projection, rename_index = source_read_args(prog_args, BytesIO(header + shard))
+
+    return seen_source_dtypes(prog_args, read_args)
+
+def read_shard(source_file, start, end):
+    with open(source_file, 'rb') as source:
+        source.seek(start)
+        return source.read(end - start)
+
+def unpack_slices(packed_batches):
+    try:
+        for packed_slices in packed_batches:
+            yield [(log_file, unpack_frame(packed)) for log_file, packed in packed_slices]
+    except BaseException:
+        # Including when the slices are closed before they're all read
+        release_batches(packed_batches)
+        raise
+
+def release_batches(packed_batches):
+    for packed_slices in packed_batches:
+        for log_file, packed in packed_slices:
+            release_frame(packed)
+
+# Free the shared memory of ranges that were parsed, or are being parsed, but 
+# won't be written.  Ranges that haven't started are cancelled.
+def release_pending(pending):
+    for future in pending:
+        if future.cancel():
+            continue
+
+        try:
+            release_batches(future.result())
+        except Exception:
+            pass
+
+def process_source_file(prog_args, source_file, output_buffer=None):
+    if split_whole_file(prog_args, source_file):
+        return
+
+    write_source_slices(prog_args, slice_source_file(prog_args, source_file), output_buffer=output_buffer)
+
+def collect_slices(prog_args, source_file):
+    # Methods that split whole source files write output files named after 
+    # the source file, these never collide with other workers so they're 
+    # written right here
+    if split_whole_file(prog_args, source_file):
+        return []
+
+    return list(slice_source_file(prog_args, source_file))
+
+# Hand the source file to split methods that process it without it being read 
+# into a DataFrame, returns True if the method did so
+def split_whole_file(prog_args, source_file):
+    split_method, method_arg = parse_method(prog_args)
+    method = load_method(split_method)
+
+    if method is None or not is_streaming(method):
+        return False
+
+    method.split_file(prog_args, source_file, method_arg, parse_skip_rows(prog_args), parse_header_row(prog_args))
+
+    return True
+
+def write_source_slices(prog_args, source_slices, written_files=None, output_buffer=None):
+    if output_buffer is not None:
+        output_buffer.add_source(source_slices)
+        return
+
+    # Keep track of where each output file ends so later rows from the same 
+    # source file can be appended
+    if written_files is None:
+        written_files = {}
+
+    # Output files created from this source file only hold its earlier rows, 
+    # later rows are added to them the same way loading the whole source file 
+    # at once would have
+    created_files = set()
+
+    for slices in source_slices:
+        write_slices(prog_args, slices, written_files, created_files)
+
+# Write every output file collected by the buffer once.  Rows from several 
+# source files are smoothed and de-duplicated together, the same as merging 
+# them into the file one source file at a time would.
+def write_buffered(prog_args, output_buffer):
+    for log_file, df_slice, sources in output_buffer.destinations():
+        if sources > 1 and not Path(log_file).exists():
+            if prog_args.smooth_timestamps:
+                df_slice.index = df_slice.index.floor(prog_args.frequency)
+            df_slice = df_slice[~df_slice.index.duplicated(keep='first')]
+
+        write_slices(prog_args, [(log_file, df_slice)])
+
+# Daemon mode, watch the source directory and slice the rows appended to 
+# matching source files as soon as they're written.  Only the complete lines 
+# added since a file was last processed are parsed, the ledger records how far 
+# that was so old data isn't processed again, even after a restart.
+def watch_sources(prog_args, src_dir, file_path):
+    if not reads_rows(prog_args):
+        return
+
+    ledger = open_ledger(prog_args)
+
+    # Where each output file ends is kept for as long as the daemon runs, so 
+    # rows appended to a source file are appended to its output files too
+    written_files = {}
+
+    try:
+        for changed_files in watch_directory(src_dir, prog_args.poll_interval):
+            for source_file in Path(src_dir).glob(file_path):
+                if changed_files is not None and source_file.name not in changed_files:
+                    continue
+
+                # A source file that can't be processed is retried the next 
+                # time it changes, it doesn't stop the others
+                try:
+                    process_appended(prog_args, source_file, ledger, written_files)
+                except Exception as err:
+                    print("ERROR: Unable to process %s: %s" % (source_file, err))
+    except KeyboardInterrupt:
+        pass
+
+# Checkpointed mode, only the rows appended to each source file since the last 
+# run are parsed and merged into the output files
+def process_checkpointed(prog_args, source_files):
+    if not reads_rows(prog_args):
+        return
+
+    ledger = open_ledger(prog_args)
+
+    for source_file in source_files:
+        process_appended(prog_args, source_file, ledger)
+
+def reads_rows(prog_args):
+    split_method, method_arg = parse_method(prog_args)
+    method = load_method(split_method)
+
+    if method is None or is_streaming(method):
+        print("ERROR: Resuming source files requires a split method that reads rows: %s" % (split_method))
+        return False
+
+    return True
+
+def open_ledger(prog_args):
+    return SourceLedger(prog_args.ledger or os.path.join(prog_args.output.strip(), LEDGER_FILENAME))
+
+# Slice the complete lines appended to a source file since the offset in the 
+# ledger, the header lines are put back in front of them so they're parsed 
+# exactly like the whole file would be
+def process_appended(prog_args, source_file, ledger, written_files=None):
+    stat = os.stat(source_file)
+
+    header_lines = data_start_line(parse_skip_rows(prog_args), parse_header_row(prog_args))
+
+    with open(source_file, 'rb') as source:
+        header = b''.join(islice(source, header_lines))
+
+        # The header itself hasn't been written completely yet
+        if header.count(b'\n') < header_lines:
+            return
+
+        offset = ledger.offset(source_file, stat, source, header)
+        if offset == stat.st_size:
+            return
+
+        if prog_args.verbose and offset:
+            print("Resuming %s from byte %d, last timestamp: %s" % (source_file, offset, ledger.last_timestamp(source_file)))
+
+        start = max(offset, len(header))
+        source.seek(start)
+        appended = source.read(stat.st_size - start)
+
+        # Leave a line that is still being written for next time
+        appended = appended[:appended.rfind(b'\n') + 1]
+
+        last_timestamp = ledger.last_timestamp(source_file) if offset else None
+
+        if appended.strip():
+            # Rows skipped after the header were skipped the first time around
+            tail_args = prog_args if start == len(header) else header_args(prog_args, header_lines)
+
+            source_slices = slice_source_file(tail_args, BytesIO(header + appended))
+            last_timestamps = []
+
+            write_source_slices(prog_args, track_last_timestamp(source_slices, last_timestamps), written_files)
+
+            if last_timestamps:
+                last_timestamp = max(last_timestamps).isoformat()
+
+        ledger.update(source_file, stat, source, header, start + len(appended), last_timestamp)
+
+# Pass batches of slices through, collecting the last timestamp of each 
+# date/time indexed slice
+def track_last_timestamp(source_slices, last_timestamps):
+    for slices in source_slices:
+        for log_file, df_slice in slices:
+            if isinstance(df_slice.index, pd.DatetimeIndex) and len(df_slice):
+                last_timestamps.append(df_slice.index.max())
+
+        yield slices
+
+# Number of lines before the first row of data, made up of the header row and 
+# skipped rows
+def data_start_line(skip_rows, header_row):
+    header_lines = 0 if header_row is None else header_row + 1
+
+    if skip_rows is None:
+        return header_lines
+
+    if isinstance(skip_rows, int):
+        return skip_rows + header_lines
+
+    # The header row is counted after the skipped rows are taken out
+    skipped = set(skip_rows)
+    line = 0
+    while header_lines > 0 or line in skipped:
+        if line not in skipped:
+            header_lines -= 1
+        line += 1
+
+    return line
+
+# Options for parsing the header lines of a source file followed by rows from 
+# further down, skipped rows past the header don't apply
+def header_args(prog_args, header_lines):
+    skip_rows = parse_skip_rows(prog_args)
+
+    if not isinstance(skip_rows, list):
+        return prog_args
+
+    header_skip_rows = [str(row) for row in skip_rows if row < header_lines]
+
+    return argparse.Namespace(**{**vars(prog_args), 'data_begins': ','.join(header_skip_rows) or None})
+
+# Read a source file and yield the rows destined for each output file, as a 
+# list of (output file, DataFrame) pairs per batch of rows read.  Columns are 
+# read with the given dtypes, when they were worked out beforehand.
+def slice_source_file(prog_args, source_file, dtypes=None):
+    read_args, projection, rename_index = source_read_args(prog_args, source_file)
+
+    # Streaming mode, read the source file in batches of rows so that memory 
+    # use is bounded by the chunk size rather than the size of the file.  Each 
+    # batch is routed to its output files before the next one is read.  
+    # Column types are worked out over the whole file first so every batch is 
+    # formatted the same as when it's loaded at once.
+    if prog_args.chunksize and dtypes is None:
+        dtypes = infer_dtypes(prog_args, read_args)
+
+    # --dtypes win
+    if dtypes:
+        read_args['dtype'] = {**dtypes, **(read_args.get('dtype') or {})}
+
+    if prog_args.chunksize:
+        for csv_chunk in pd.read_csv(chunksize=prog_args.chunksize, **read_args):
+            csv_chunk.index = parse_source_index(prog_args, csv_chunk.index)
+            csv_chunk = prepare_data(prog_args, csv_chunk, rename_index, projection)
+            yield slice_data(prog_args, csv_chunk)
+
+        return
+
+    csv_data = pd.read_csv(**read_args)
+    csv_data.index = parse_source_index(prog_args, csv_data.index)
+    csv_data = prepare_data(prog_args, csv_data, rename_index, projection)
+
+    yield slice_data(prog_args, csv_data)
+
+# read_csv() arguments for a source file, the column projection and the name 
+# the index column is renamed to
+def source_read_args(prog_args, source_file):
+    skip_rows = parse_skip_rows(prog_args)
+
+    header_row = parse_header_row(prog_args)
+
+    index_column, rename_index = parse_index_column(prog_args)
+
+    # Open source file using provided source path, header row number and skip 
+    # rows arguments
+    read_args = dict(
+        filepath_or_buffer=source_file,
+        header=header_row,
+        skiprows=skip_rows,
+        index_col=index_column
+    )
+
+    # Only read the columns that are kept, with the requested dtypes
+    projection = project_columns(prog_args, read_args)
+    if projection is not None:
+        projected_args, column_names = projection
+        read_args.update(projected_args)
+
+    return read_args, projection, rename_index
+
+# Dtypes of the columns of a source file read in batches, as loading the whole 
+# file would infer them from the dtypes inferred for each batch.  Costs an 
+# extra pass over the file, without parsing any timestamps.
+def infer_dtypes(prog_args, read_args):
+    return combine_seen_dtypes(seen_source_dtypes(prog_args, read_args))
+
+# Dtypes inferred for the index and the other columns in each batch of a 
+# source file, the source is rewound afterwards
+def seen_source_dtypes(prog_args, read_args):
+    if prog_args.chunksize:
+        batches = pd.read_csv(chunksize=prog_args.chunksize, **read_args)
+    else:
+        batches = [pd.read_csv(**read_args)]
+
+    seen_dtypes = {}
+
+    for csv_chunk in batches:
+        add_dtypes(seen_dtypes, [(csv_chunk.index.name, csv_chunk.index.dtype)])
+        add_dtypes(seen_dtypes, csv_chunk.dtypes.items())
+
+    source = read_args['filepath_or_buffer']
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    return seen_dtypes
+
+# Work out from the header of a source file which of its columns end up in 
+# the output files, after dropping "Unnamed" columns, assigning the column 
+# names and dropping columns, so the others are never parsed.  Returns the 
+# read_csv() arguments that read only those columns, with the dtypes from 
+# --dtypes, and the names the columns are given, or None when every column is 
+# kept and no dtypes are set.
+def project_columns(prog_args, read_args):
+    dtypes = parse_dtypes(prog_args)
+
+    if prog_args.keep_empty and not prog_args.drop_columns and not dtypes:
+        return None
+
+    source = read_args['filepath_or_buffer']
+    header = pd.read_csv(source, header=read_args['header'], skiprows=read_args['skiprows'], nrows=0).columns
+
+    if hasattr(source, 'seek'):
+        source.seek(0)
+
+    # Name the index column so it can't be confused with a position among 
+    # the selected columns
+    index_column = read_args['index_col']
+    if index_column not in header:
+        try:
+            index_column = header[int(index_column)]
+        except (TypeError, ValueError, IndexError):
+            return None
+
+    columns = [column for column in header if column != index_column]
+
+    if not prog_args.keep_empty:
+        columns = [column for column in columns if not str(column).startswith('Unnamed')]
+
+    names = columns
+    if prog_args.column_names:
+        names = prog_args.column_names.strip().split(",")
+
+    dropped = set()
+    if prog_args.drop_columns:
+        dropped = set(prog_args.drop_columns.strip().split(","))
+
+    # Leave mismatched names and unknown columns for prepare_data() to report
+    if len(names) != len(columns) or not dropped.issubset(names):
+        return None
+
+    unknown_dtypes = set(dtypes).difference(names)
+    if unknown_dtypes:
+        raise ValueError("Unknown columns in --dtypes: %s" % (", ".join(sorted(map(str, unknown_dtypes)))))
+
+    kept = [(column, name) for column, name in zip(columns, names) if name not in dropped]
+
+    if len(kept) == len(header) - 1 and not dtypes:
+        return None
+
+    projected_args = dict(
+        usecols=[index_column] + [column for column, name in kept],
+        index_col=index_column,
+        dtype={column: dtypes[name] for column, name in kept if name in dtypes},
+    )
+
+    return projected_args, [name for column, name in kept]
+
+# Parse --dtypes, a JSON object of column names and the dtypes to read them as 
+# or the path of a JSON file containing one
+def parse_dtypes(prog_args):
+    if not prog_args.dtypes:
+        return {}
+
+    dtypes = prog_args.dtypes.strip()
+
+    if os.path.isfile(dtypes):
+        with open(dtypes) as schema_file:
+            return json.load(schema_file)
+
+    return json.loads(dtypes)
+
+# Parse the timestamps of a source file's index in a single vectorized pass 
+# with a known format, --date-format-in or the format guessed from the first 
+# file of the source glob
+def parse_source_index(prog_args, index):
+    # Same as parse_dates=True, only text is parsed as timestamps
+    if index.dtype != object:
+        return index
+
+    date_format = (prog_args.date_format_in or SOURCE_DATE_FORMATS.get(prog_args.source_file) 
+        or guess_date_format(index))
+
+    if date_format:
+        try:
+            parsed_index = pd.to_datetime(index, format=date_format)
+        except (ValueError, TypeError):
+            # Guess again from the next file
+            SOURCE_DATE_FORMATS.pop(prog_args.source_file, None)
+        else:
+            if not prog_args.date_format_in:
+                SOURCE_DATE_FORMATS[prog_args.source_file] = date_format
+
+            return parsed_index
+
+    return infer_date_index(index)
+
+def guess_date_format(index):
+    values = index.dropna()
+    if len(values) == 0 or not isinstance(values[0], str):
+        return None
+
+    return guess_datetime_format(values[0])
+
+# Parse an index of timestamps with the first of the formats that matches all 
+# of them, or by inferring the format when none do
+def parse_date_index(index, date_formats):
+    if index.dtype != object:
+        return index
+
+    for date_format in date_formats:
+        try:
+            return pd.to_datetime(index, format=date_format)
+        except (ValueError, TypeError):
+            pass
+
+    return infer_date_index(index)
+
+# Same as parse_dates=True, an index of text is parsed with an inferred format 
+# and left as is when it can't be.  Numeric indexes (ids, counters) are never 
+# taken for epoch timestamps.
+def infer_date_index(index):
+    if index.dtype != object:
+        return index
+
+    return pd.to_datetime(index, errors='ignore')
 
-def process_source_file(prog_args, source_file):
+def parse_method(prog_args):
+    split_method, method_arg = prog_args.method.strip().split(':', 1)
+
+    return split_method, method_arg
+
+def parse_skip_rows(prog_args):
     # Check if headers and data begins at a set row
     try:
         skip_rows = int(prog_args.data_begins)
@@ -25,12 +661,18 @@ def process_source_file(prog_args, source_file):
     # If CSV file is more complex and specific rows should be skipped then 
     # accept a list of 0-based row numbers that should be skipped instead
     except ValueError:
-        skip_rows = map(int, prog_args.data_begins.strip().split(","))
+        skip_rows = list(map(int, prog_args.data_begins.strip().split(",")))
+
+    return skip_rows
 
+def parse_header_row(prog_args):
     header_row = int(prog_args.names.strip())
     if header_row < 0:
         header_row = None
 
+    return header_row
+
+def parse_index_column(prog_args):
     try:
         index_column, rename_index = prog_args.column.strip().split(":")
 
@@ -42,19 +684,27 @@ def process_source_file(prog_args, source_file):
         index_column = prog_args.column
         rename_index = None
 
-    # Open source file using provided source path, header row number and skip 
-    # rows arguments
-    csv_data = pd.read_csv(
-        filepath_or_buffer=source_file,
-        header=header_row,
-        skiprows=skip_rows,
-        parse_dates=True,
-        index_col=index_column
-    )
-    
+    return index_column, rename_index
+
+def prepare_data(prog_args, csv_data, rename_index, projection=None):
     if prog_args.verbose:
         print("Initial state of data...")
         print(csv_data)
+
+    if rename_index:
+        csv_data.index.name = rename_index
+
+    # Columns that aren't kept were never read, the ones that were only need 
+    # their names
+    if projection is not None:
+        projected_args, column_names = projection
+        csv_data.columns = column_names
+
+        if prog_args.verbose:
+            print("State of data before writing out files...")
+            print(csv_data)
+
+        return csv_data
     
     # Remove "Unnamed" (i.e. blank columns with no header name) columns from CSV by default,
     # keep them if specifically specified by the user
@@ -65,9 +715,6 @@ def process_source_file(prog_args, source_file):
     if not prog_args.keep_empty:
         csv_data = csv_data.loc[:, ~csv_data.columns.str.contains('^Unnamed')]
 
-    if rename_index:
-        csv_data.index.name = rename_index
-
     if prog_args.column_names:
         column_names = prog_args.column_names.strip().split(",")
         csv_data.columns = column_names
@@ -79,92 +726,161 @@ def process_source_file(prog_args, source_file):
         print("State of data before writing out files...")
         print(csv_data)
 
-    # Write files out in prescribed format
-    write_files(prog_args, csv_data)
+    return csv_data
 
-def write_files(prog_args, csv_data):
-    split_method, interval_format = prog_args.method.strip().split(':')
+# Index a DataFrame that wasn't read from a source file by this script (e.g.
+# one handed over by another pipeline stage) on the index column, the same
+# way reading a source file does
+def index_data(prog_args, csv_data):
+    if isinstance(csv_data.index, pd.DatetimeIndex):
+        return csv_data
+
+    index_column, rename_index = parse_index_column(prog_args)
 
-    # Get index column from program args
     try:
-        index_column, rename_index = prog_args.column.strip().split(":")
+        index_column = csv_data.columns[int(index_column)]
     except ValueError:
-        index_column = prog_args.column.strip()
-        rename_index = None
+        pass
 
-    except AttributeError:
-        index_column = prog_args.column
-        rename_index = None
+    csv_data = csv_data.set_index(index_column)
+    csv_data.index = infer_date_index(csv_data.index)
+
+    return csv_data
+
+def write_files(prog_args, csv_data, written_files=None):
+    write_slices(prog_args, slice_data(prog_args, csv_data), written_files)
+
+# Split the data into the subsets that belong in each output file, returns a 
+# list of (output file, DataFrame) pairs
+def slice_data(prog_args, csv_data):
+    split_method, method_arg = parse_method(prog_args)
+
+    # Get index column from program args
+    index_column, rename_index = parse_index_column(prog_args)
 
     if rename_index:
         index_column = rename_index
 
-    #importlib.import_module(('methods/%s.py' % split_method))
+    # The split method works out which data file every row belongs to, rows 
+    # are then grouped by their destination
+    method = load_method(split_method)
 
-    # Currently only method of slicing is "date", translate index into date/time
-    if split_method == 'date':
-        if prog_args.adjust_tz: # if datetime is not UTC adjust accordingly
-            adjust_tz, destination_tz = prog_args.adjust_tz.strip().split(":")
-            
-            # if index is not already a DateTimeIndex then recreate it as one
-            if not isinstance(csv_data.index, pd.DatetimeIndex):
-                csv_data[index_column] = pd.to_datetime(csv_data[index_column]) + timedelta(hours=float(adjust_tz))
-                        
-                # set index, necessary grouping rows by interval format
-                csv_data.set_index(index_column, inplace=True)
-
-                csv_data.index = csv_data.index.tz_localize(destination_tz)
-            # index is already a DateTimeIndex but timezones need to be adjusted
-            else:
-                # DateTimeIndex can be timezone aware (has one) or timezone 
-                # naive (doesn't have a tz)
-                try:
-                    csv_data.index = csv_data.index.tz_convert(destination_tz)
-                except TypeError as err:
-                    new_index = csv_data.index + timedelta(hours=float(adjust_tz))
+    if method is None or is_streaming(method):
+        print("ERROR: Unable to create index.")
+        return []
 
-                    csv_data.index = new_index.tz_localize(destination_tz)
+    csv_data, log_files = method.bucket(prog_args, csv_data, method_arg, index_column)
 
-        elif not isinstance(csv_data.index, pd.DatetimeIndex):
-            csv_data[index_column] = pd.to_datetime(csv_data[index_column])
-        
-            # set index, necessary grouping rows by interval format
-            csv_data.set_index(index_column, inplace=True)
+    if prog_args.verbose:
+        print("List of files to be generated...")
+        print(pd.unique(log_files))
 
-        # generate path names using output path and file name format arguments
-        file_path = '%s/%s' % (prog_args.output.strip(), prog_args.filename_format.strip())
+    return list(csv_data.groupby(log_files, sort=False))
 
-        # create list of data files and their full paths
-        log_files = csv_data.index.strftime(file_path).unique()
+# Write each subset of data to its output file, merging it with the contents 
+# of the file if it already exists.  Output files in created_files were 
+# created by earlier batches of the same source file, rows are added to those 
+# without being merged.
+def write_slices(prog_args, slices, written_files=None, created_files=None):
+    index_column, rename_index = parse_index_column(prog_args)
 
-        # create a list of unique days present in the master dataframe
-        # use this to create subsets of each days worth of data
-        log_file_index = csv_data.index.strftime(interval_format).unique()
+    if rename_index:
+        index_column = rename_index
 
-    # Split source file by an arbitrary number of rows
-    elif  split_method == 'chunk':
-        pass
+    # Keep track of where each output file ends so later rows can be appended
+    if written_files is None:
+        written_files = {}
 
-    else:
-        print("ERROR: Unable to create index.")
-        log_file_index = []
+    if created_files is None:
+        created_files = set()
 
-    
-    if prog_args.verbose:
-        print("List of files to be generated...")
-        print(log_file_index)
+    # Only text output can be appended to, columnar files are always rewritten
+    appendable = prog_args.output_format == 'csv'
+
+    # Loop through each data file and the subset of the master dataframe that 
+    # belongs in it
+    for log_file, df_slice in slices:
+        # With a dedup index the new rows are checked against the keys of the 
+        # rows already in an existing output file, without loading the file, 
+        # and the ones it already holds are dropped before anything else
+        if prog_args.dedup_index and log_file not in created_files and Path(log_file).exists():
+            existing_keys = load_output_keys(prog_args, log_file, index_column)
+            df_slice = drop_indexed_rows(prog_args, df_slice, existing_keys)
+
+            if df_slice.empty:
+                continue
+
+            # Only timestamp keys are ordered, hashed keys can't tell where 
+            # the file ends
+            if (appendable and log_file not in written_files and len(existing_keys) 
+                    and isinstance(df_slice.index, pd.DatetimeIndex)
+                    and read_header_line(log_file) == header_line(prog_args, df_slice)):
+                written_files[log_file] = (key_timestamp(existing_keys[-1], df_slice.index), True)
+
+        # In incremental mode an existing output file only needs to be merged 
+        # when the new rows overlap it in time, check the last row of the file 
+        # to find out where it currently ends
+        if (appendable and prog_args.incremental and log_file not in written_files 
+                and Path(log_file).exists()):
+            last_entry = read_last_entry(prog_args, log_file)
+
+            if last_entry and last_entry[0] == header_line(prog_args, df_slice):
+                written_files[log_file] = (last_entry[1], True)
+
+        # When streaming a source file in chunks an output file may already 
+        # have been written by an earlier chunk of this run.  If every new row 
+        # comes after the last timestamp written to it, the rows can simply be 
+        # appended to the end of the file instead of re-reading and rewriting 
+        # the whole thing.
+        if appendable and log_file in written_files:
+            last_timestamp, merged = written_files[log_file]
+            df_append = df_slice
+
+            # Rows headed for a file that went through the merge below receive 
+            # the same smoothing and de-duplication they would have received 
+            # had the whole source been loaded at once
+            if merges_rows(prog_args, log_file, merged, created_files):
+                if prog_args.smooth_timestamps:
+                    df_append.index = df_append.index.floor(prog_args.frequency)
+                df_append = df_append[~df_append.index.duplicated(keep='first')]
+
+            df_append = df_append.sort_index(kind='mergesort')
+
+            try:
+                can_append = df_append.index[0] > last_timestamp
+
+            # Timezone naive and aware timestamps can't be compared, leave it to 
+            # the merge to sort out
+            except TypeError:
+                can_append = False
+
+            if can_append:
+                df_append.to_csv(log_file, mode='a', header=False, date_format=prog_args.date_format_out)
+                written_files[log_file] = (df_append.index[-1], merged)
+
+                if prog_args.dedup_index:
+                    append_keys(log_file, index_keys(df_append.index))
+
+                continue
 
+        merged = log_file not in created_files and Path(log_file).exists()
 
-    # Loop through list of log file names
-    for index, log_file in enumerate(log_files):
-        date_key = log_file_index[index]
+        if log_file in created_files:
+            # Earlier rows of the same source file, read back with the column 
+            # types of the new rows so they're written out the same again
+            df_tmp = read_output(prog_args, log_file, index_column, df_slice.dtypes.to_dict())
+            df_tmp = df_tmp.append(df_slice, sort=False)
 
-        if Path(log_file).exists():
+            if appends_to_existing(prog_args) and prog_args.smooth_timestamps:
+                df_tmp.index = df_tmp.index.floor(prog_args.frequency)
+                df_tmp = df_tmp[~df_tmp.index.duplicated(keep='first')]
+
+        elif merged:
             # load existing data
-            df_tmp = pd.read_csv(log_file, index_col=index_column, parse_dates=True)
+            df_tmp = read_output(prog_args, log_file, index_column)
 
             # add all data from this day to existing dataframe
-            df_tmp = df_tmp.append(csv_data.loc[date_key], sort=False)
+            df_tmp = df_tmp.append(df_slice, sort=False)
             
             # Smooths out date/time indexes that are close and should be 
             # considered the same sample time but may vary because of how 
@@ -190,23 +906,175 @@ def write_files(prog_args, csv_data):
         else:
             # if no current file exists then create a dataframe from a subset
             # of the master dataframe and write its contents out to the file
-            df_tmp = csv_data.loc[date_key]
+            df_tmp = df_slice
 
-        # sort data by index (timestamp) in ascending order
-        df_write = df_tmp.sort_index()
+            # Incrementally maintained files may never be merged again, so 
+            # smooth them as they are first written rather than on the next 
+            # merge
+            if appends_to_existing(prog_args) and prog_args.smooth_timestamps:
+                df_tmp.index = df_tmp.index.floor(prog_args.frequency)
+                df_tmp = df_tmp[~df_tmp.index.duplicated(keep='first')]
+
+        # sort data by index (timestamp) in ascending order, rows with the 
+        # same timestamp are kept in the order they were read
+        df_write = df_tmp.sort_index(kind='mergesort')
 
         # check output path and create directory paths that do not exist
         if not Path(os.path.dirname(log_file)).exists():
             os.makedirs(os.path.dirname(log_file))
 
+        if not Path(log_file).exists():
+            created_files.add(log_file)
+
         # write out to data file
-        df_write.to_csv(log_file, date_format=prog_args.date_format_out)
+        write_output(prog_args, df_write, log_file)
+
+        if prog_args.dedup_index:
+            write_keys(log_file, index_keys(df_write.index))
+
+        written_files[log_file] = (df_write.index[-1], merged or appends_to_existing(prog_args))
 
         # destroy temporary DataFrames
         df_tmp = None
         df_write = None
 
-if __name__ == "__main__":
+# Whether new rows for an output file are smoothed and de-duplicated the way 
+# merging them into the file would.  Rows for files created from the same 
+# source file only are when new files are smoothed.
+def merges_rows(prog_args, log_file, merged, created_files):
+    if log_file in created_files:
+        return appends_to_existing(prog_args) and prog_args.smooth_timestamps
+
+    return merged
+
+# Read an existing output file in the selected output format.  Columnar 
+# formats store the timestamp index natively so nothing needs to be parsed.  
+# CSV files are read with the given dtypes, or the --dtypes.
+def read_output(prog_args, log_file, index_column, dtypes=None):
+    if prog_args.output_format == 'parquet':
+        return pd.read_parquet(log_file)
+
+    if prog_args.output_format == 'feather':
+        df_read = pd.read_feather(log_file)
+
+        # Feather can't store an index, it's written out as the first column
+        return df_read.set_index(df_read.columns[0])
+
+    df_read = pd.read_csv(log_file, index_col=index_column, dtype=dtypes or parse_dtypes(prog_args) or None)
+    df_read.index = parse_date_index(df_read.index, written_date_formats(prog_args))
+
+    return df_read
+
+# Formats timestamps written with --date-format-out can be parsed with, %z is 
+# left empty for timezone naive timestamps
+def written_date_formats(prog_args):
+    date_formats = [prog_args.date_format_out]
+
+    if '%z' in prog_args.date_format_out:
+        date_formats.append(prog_args.date_format_out.replace('%z', ''))
+
+    return date_formats
+
+# Write an output file in the selected output format
+def write_output(prog_args, df_write, log_file):
+    if prog_args.output_format == 'parquet':
+        df_write.to_parquet(log_file)
+
+    elif prog_args.output_format == 'feather':
+        df_write.reset_index().to_feather(log_file)
+
+    else:
+        df_write.to_csv(log_file, date_format=prog_args.date_format_out)
+
+# Whether new rows may be appended to output files that existed before this 
+# run rather than always merging them
+def appends_to_existing(prog_args):
+    return prog_args.incremental or prog_args.dedup_index
+
+# Keys of the rows in an existing output file, taken from its dedup index 
+# sidecar.  The sidecar is rebuilt from the file when it's missing or was 
+# written for a different version of the file.
+def load_output_keys(prog_args, log_file, index_column):
+    existing_keys = load_keys(log_file)
+
+    if existing_keys is None:
+        if prog_args.verbose:
+            print("Building dedup index for: ", log_file)
+
+        existing_keys = index_keys(read_output(prog_args, log_file, index_column).index)
+        write_keys(log_file, existing_keys)
+
+    return existing_keys
+
+# Drop the rows whose timestamps are already in the output file, smoothing 
+# them first when requested since the file holds smoothed timestamps
+def drop_indexed_rows(prog_args, df_slice, existing_keys):
+    if prog_args.smooth_timestamps:
+        df_slice.index = df_slice.index.floor(prog_args.frequency)
+
+    return df_slice[~contains_keys(existing_keys, index_keys(df_slice.index))]
+
+# Timestamp of a dedup key, comparable with the timestamps of index
+def key_timestamp(key, index):
+    if index.tz is not None:
+        return pd.Timestamp(key, tz='UTC')
+
+    return pd.Timestamp(key)
+
+def read_header_line(log_file):
+    with open(log_file, 'rb') as data_file:
+        return data_file.readline().decode().rstrip('\r\n')
+
+# Header line that to_csv() writes for a DataFrame
+def header_line(prog_args, csv_data):
+    return csv_data.iloc[:0].to_csv(date_format=prog_args.date_format_out).splitlines()[0]
+
+# Read the header and the timestamp of the last row of an existing output file 
+# without loading the file, only the first line and the tail are read.  The 
+# timestamp is parsed with --date-format-out, returns None if it can't be 
+# determined that way.
+def read_last_entry(prog_args, log_file, block_size=4096):
+    header = read_header_line(log_file)
+
+    with open(log_file, 'rb') as data_file:
+        data_file.seek(0, os.SEEK_END)
+        file_size = data_file.tell()
+
+        # Read backwards from the end of the file until at least one complete 
+        # line has been found
+        tail = b''
+        position = file_size
+        while position > 0:
+            read_size = min(block_size, position)
+            position -= read_size
+            data_file.seek(position)
+            tail = data_file.read(read_size) + tail
+
+            if tail.rstrip().count(b'\n') > 0:
+                break
+
+    lines = tail.decode().strip().splitlines()
+    if len(lines) < 2 and position == 0:
+        # Only a header, nothing to compare against
+        return None
+
+    last_row = next(csv.reader([lines[-1]]))
+    if not last_row:
+        return None
+
+    # Inferring the format could read the day as the month, leave anything the 
+    # formats don't parse to the merge
+    for date_format in written_date_formats(prog_args):
+        try:
+            return header, pd.to_datetime(last_row[0], format=date_format)
+        except (ValueError, TypeError):
+            pass
+
+    return None
+
+# Command line options, pipeline.py builds the options of its stages from 
+# these as well
+def build_parser():
     parser = argparse.ArgumentParser()
 
     parser.add_argument(
@@ -226,7 +1094,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "-f",
         "--filename_format",
-        help="How output file names should be formatted, can and should contain date formatting string.  Example: test_data_%%Y-%%m-%%d.csv",
+        help="How output file names should be formatted, can and should contain date formatting string.  Example: test_data_%%Y-%%m-%%d.csv.  When splitting by row count the {source}, {index} and {suffix} placeholders are available instead, default: {source}_{index:04d}{suffix}.  When splitting by value the {value} placeholder is available instead, default: {value}.csv",
         action="store",
     )
 
@@ -248,7 +1116,7 @@ if __name__ == "__main__":
     parser.add_argument(
         "-m",
         "--method",
-        help="How column should be used to split data by date.  Specify in terms for python date formatting string. Example: date:%%Y%%m%%d",
+        help="How column should be used to split data by date.  Specify in terms for python date formatting string. Example: date:%%Y%%m%%d.  Rows are grouped by the file names --filename_format gives their timestamps, so the date format should match the date part of it, a warning is printed when the date format is finer than the file names.  Other methods: chunk:N splits the source file into files of N rows each without parsing it, value:<column> splits rows by the unique values of a column and window:<frequency> splits rows into fixed length windows of time (e.g. window:6H).  See --filename_format for naming these files.",
         default="date:%Y%m%d",
         action="store",
     )
@@ -283,6 +1151,12 @@ if __name__ == "__main__":
         action="store",
     )
 
+    parser.add_argument(
+        "--dtypes",
+        help="A JSON object of column names (as in the output files) and the dtypes they should be read as, or the path of a JSON schema file containing one.  Example: {\"temperature\":\"float32\",\"flag\":\"int8\"}.  Columns that are dropped are never parsed, default: None",
+        action="store",
+    )
+
     parser.add_argument(
         "-z",
         "--adjust-tz",
@@ -290,6 +1164,12 @@ if __name__ == "__main__":
         action="store",
     )
 
+    parser.add_argument(
+        "--date-format-in",
+        help="Format of the date/times in the source files, parsed in a single pass without inferring the format.  When not given, the format is guessed from the first source file and used for the others.  Date/times that don't match the format are parsed by inferring it, default: None",
+        action="store",
+    )
+
     parser.add_argument(
         "--date-format-out",
         help="Specifies how date/times should be formatted in the resulting files.  By default, this uses ISO 8601: %%Y-%%m-%%dT%%H:%%M:%%S%%z",
@@ -297,6 +1177,14 @@ if __name__ == "__main__":
         default='%Y-%m-%dT%H:%M:%S%z',
     )
 
+    parser.add_argument(
+        "--output-format",
+        help="File format of the output files, parquet and feather store the timestamp index natively so existing files can be merged without parsing text again.  NOTE: The parquet and feather formats require pyarrow to be installed, --date-format-out only applies to csv, default: csv",
+        choices=["csv", "parquet", "feather"],
+        default="csv",
+        action="store",
+    )
+
     parser.add_argument(
         "--frequency",
         help="Specifies frequency interval to be used for index.floor() of a pandas DataFrame to handle duplicate entires, default: S, more info here: https://pandas.pydata.org/pandas-docs/stable/user_guide/timeseries.html#timeseries-offset-aliases",
@@ -310,12 +1198,89 @@ if __name__ == "__main__":
         action="store_true",
     )
 
+    parser.add_argument(
+        "--incremental",
+        help="Append new rows to the end of existing output files, after checking only the last row of the file, when all of them come later than the data already in the file.  Files whose time range overlaps the new data are still fully merged.  When combined with --smooth_timestamps, new files are smoothed as they are first written.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--dedup-index",
+        help="Keep the timestamps of every output file in a compact sidecar file (<output file>.keys) and check new rows against it, rows already in the file are dropped without loading it.  New rows that all come after the end of the file are appended, only overlapping rows cause the file to be merged and rewritten.  When combined with --smooth_timestamps, new files are smoothed as they are first written.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--chunksize",
+        help="Stream the source file in batches of this many rows instead of loading it all at once, keeping memory use bounded by the chunk size.  Column types are worked out over all the batches first, the same as when the whole file is loaded, which takes one extra pass over the file, default: None",
+        type=int,
+        action="store",
+    )
+
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes used to parse and slice source files in parallel.  Output files are only ever written by the main process, in the same order as a serial run, default: 1",
+        type=int,
+        default=1,
+        action="store",
+    )
+
+    parser.add_argument(
+        "--shard-size",
+        help="Split every source file into byte ranges of about this many MB, cut at line ends, and parse and slice the ranges in the --workers processes, so a single large source file is spread over all of them.  The header and --data-begins are applied once for the whole file.  Column types are worked out over all the ranges first, the same as when the file is loaded at once, which takes one extra pass over the ranges.  NOTE: Quoted fields can't span lines, default: None",
+        type=int,
+        action="store",
+    )
+
+    parser.add_argument(
+        "--buffer-outputs",
+        help="Collect the rows for each output file from all the source files and write every output file once at the end of the run, instead of merging rows into it once per source file.  Rows past --buffer-memory are spilled to temporary files.  NOTE: Doesn't apply to --watch and --checkpoint.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--buffer-memory",
+        help="Memory budget of --buffer-outputs in MB, default: 512",
+        type=int,
+        default=512,
+        action="store",
+    )
+
+    parser.add_argument(
+        "--watch",
+        help="Keep running and slice the rows appended to matching source files as soon as they're written, watching the source directory with inotify (Linux) or by polling.  Only complete lines added since a file was last processed are read, as recorded in the ledger.  Combine with --incremental or --dedup-index so outputs that existed before the daemon started are appended to rather than rewritten.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--checkpoint",
+        help="Keep a checkpoint of how far each source file has been processed (byte offset, last timestamp and fingerprints of the header and last processed bytes) in the ledger, later runs only parse the rows appended since.  Files that were truncated, replaced or rewritten are processed again from the start.  NOTE: Source files are processed one at a time, --workers doesn't apply.",
+        action="store_true",
+    )
+
+    parser.add_argument(
+        "--ledger",
+        help="File recording how much of each source file has been processed by --watch and --checkpoint, default: <output>/%s" % (LEDGER_FILENAME),
+        action="store",
+    )
+
+    parser.add_argument(
+        "--poll-interval",
+        help="Seconds between checks of the source directory by --watch when inotify isn't available, default: 1",
+        type=float,
+        default=1.0,
+        action="store",
+    )
+
     parser.add_argument(
         "--verbose",
         help="Display more information about how data is being transformed/sliced at various stages in the process.",
         action="store_true",
     )
 
-    prog_args = parser.parse_args()
-    
+    return parser
+
+if __name__ == "__main__":
+    prog_args = build_parser().parse_args()
+
     main(prog_args)
@@ -0,0 +1,101 @@
+"""
+Persistent de-duplication keys for output files.
+
+The keys of the rows in a data file are kept in a sidecar file next to it
+(<data file>.keys) so incoming rows can be checked against the rows already
+written without loading the data file itself.  Timestamps are stored as int64
+nanoseconds since the epoch (UTC for timezone aware data), any other values
+as 64-bit hashes.
+
+The sidecar is a flat array of little-endian int64 values, the first two are
+the size and modification time (ns) of the data file when the keys were last
+written and are used to detect data files that were changed by something
+else.  The keys follow in ascending order, so the sidecar is memory-mapped and
+incoming keys are looked up with a binary search, only the pages they land on
+are read.  Keys of rows appended past the end of a data file sorted on its
+timestamps are appended in place, anything else rewrites the sidecar.
+"""
+import os
+import numpy as np
+import pandas as pd
+
+SIDECAR_SUFFIX = '.keys'
+KEY_DTYPE = np.dtype('<i8')
+
+# Number of int64 values at the start of the sidecar describing the data file
+HEADER_LENGTH = 2
+
+def sidecar_path(data_path):
+    return '%s%s' % (data_path, SIDECAR_SUFFIX)
+
+def index_keys(index):
+    if isinstance(index, pd.DatetimeIndex):
+        return index.asi8.astype(KEY_DTYPE, copy=False)
+
+    return hash_keys(index)
+
+def hash_keys(values):
+    hashed = pd.util.hash_array(np.asarray(values, dtype=object))
+
+    return hashed.view(KEY_DTYPE)
+
+def data_file_state(data_path):
+    stat = os.stat(data_path)
+
+    return np.array([stat.st_size, stat.st_mtime_ns], dtype=KEY_DTYPE)
+
+# Returns the sorted keys of the data file, memory-mapped, or None when there
+# is no sidecar or it no longer matches the data file
+def load_keys(data_path):
+    try:
+        stored = np.memmap(sidecar_path(data_path), dtype=KEY_DTYPE, mode='r')
+    except (FileNotFoundError, ValueError):
+        return None
+
+    if len(stored) < HEADER_LENGTH or not np.array_equal(stored[:HEADER_LENGTH], data_file_state(data_path)):
+        return None
+
+    return stored[HEADER_LENGTH:]
+
+# Replace the keys of the data file, call after the data file has been written.
+# The sidecar is replaced rather than overwritten, keys loaded from it before
+# stay readable.
+def write_keys(data_path, keys):
+    path = sidecar_path(data_path)
+    temp_path = '%s.tmp' % (path)
+
+    with open(temp_path, 'wb') as sidecar:
+        data_file_state(data_path).tofile(sidecar)
+        np.sort(np.asarray(keys, dtype=KEY_DTYPE)).tofile(sidecar)
+
+    os.replace(temp_path, path)
+
+# Add the keys of rows appended to the data file, call after the rows have been
+# appended.  When they all sort after the stored keys only the header and the
+# new keys are written, otherwise the sidecar is rewritten.
+def append_keys(data_path, keys):
+    keys = np.sort(np.asarray(keys, dtype=KEY_DTYPE))
+    path = sidecar_path(data_path)
+
+    stored = np.memmap(path, dtype=KEY_DTYPE, mode='r')
+
+    if len(keys) and len(stored) > HEADER_LENGTH and keys[0] <= stored[-1]:
+        write_keys(data_path, np.concatenate((stored[HEADER_LENGTH:], keys)))
+        return
+
+    del stored
+
+    with open(path, 'r+b') as sidecar:
+        data_file_state(data_path).tofile(sidecar)
+
+        sidecar.seek(0, os.SEEK_END)
+        keys.tofile(sidecar)
+
+# Boolean mask of which keys are already present in the sorted existing_keys
+def contains_keys(existing_keys, keys):
+    if len(existing_keys) == 0:
+        return np.zeros(len(keys), dtype=bool)
+
+    positions = np.searchsorted(existing_keys, keys).clip(max=len(existing_keys) - 1)
+
+    return existing_keys[positions] == keys
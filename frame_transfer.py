@@ -0,0 +1,95 @@
+"""
+Hands DataFrames from worker processes back to the main process as Arrow IPC
+streams in shared memory, rather than pickling them through the process
+pool's pipe.  Only the name and size of the shared memory block travel
+through the pipe.
+
+Without pyarrow, or for data Arrow can't represent (e.g. columns mixing
+numbers and text), DataFrames are pickled as usual.
+
+NOTE: Missing values in text columns come back as None rather than NaN,
+both are written out as empty fields.
+"""
+from multiprocessing import shared_memory, resource_tracker
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# Pack a DataFrame in a worker process, returns a small picklable tuple
+def pack_frame(df):
+    if pa is None:
+        return ('pickle', df)
+
+    try:
+        table = pa.Table.from_pandas(df, preserve_index=True)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return ('pickle', df)
+
+    # Work out the size of the stream first so it can be written straight
+    # into the shared memory block
+    mock_sink = pa.MockOutputStream()
+    with pa.ipc.new_stream(mock_sink, table.schema) as writer:
+        writer.write_table(table)
+    size = mock_sink.size()
+
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    write_stream(table, block.buf)
+
+    # The main process takes over the block and unlinks it once it's read, or 
+    # with release_frame() when it isn't going to be
+    resource_tracker.unregister(block._name, 'shared_memory')
+    block.close()
+
+    return ('arrow', block.name, size)
+
+def write_stream(table, buf):
+    sink = pa.FixedSizeBufferWriter(pa.py_buffer(buf))
+
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    sink.close()
+
+# Unpack a DataFrame packed by pack_frame() and free its shared memory
+def unpack_frame(packed):
+    if packed[0] == 'pickle':
+        return packed[1]
+
+    _, name, size = packed
+
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        df = read_stream(block.buf, size)
+
+        try:
+            block.close()
+        except BufferError:
+            # Some columns (e.g. categoricals) still point into the block, 
+            # read those from a copy of it instead
+            del df
+            df = read_stream(bytes(block.buf[:size]), size)
+            block.close()
+    finally:
+        block.unlink()
+
+    return df
+
+def read_stream(buf, size):
+    return pa.ipc.open_stream(pa.py_buffer(buf)[:size]).read_all().to_pandas()
+
+# Free the shared memory of a DataFrame packed by pack_frame() without reading 
+# it, when it won't be unpacked after all.  Blocks that were already freed are 
+# skipped.
+def release_frame(packed):
+    if packed[0] == 'pickle':
+        return
+
+    try:
+        block = shared_memory.SharedMemory(name=packed[1])
+    except FileNotFoundError:
+        return
+
+    block.close()
+    block.unlink()
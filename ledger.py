@@ -0,0 +1,85 @@
+"""
+Ledger of how much of each source file has already been processed, so only
+the bytes appended to a growing source file since then need to be read.
+
+The ledger is a JSON file holding a checkpoint for every source file path:
+the byte offset up to which it has been processed, the inode of the file,
+fingerprints (CRC32) of its header lines and of the last bytes before the
+offset, and the last timestamp read from it.  A file whose inode changed,
+that is now shorter than its offset or whose fingerprinted bytes no longer
+match (it was replaced, truncated or rewritten, e.g. by log rotation) is
+processed again from the start.
+"""
+import os
+import json
+import zlib
+
+# Number of bytes before the offset covered by the tail fingerprint
+TAIL_LENGTH = 256
+
+class SourceLedger:
+    """
+    Checkpoints of processed source files, saved to a JSON file after every
+    update so a later run carries on where the last one stopped.
+    """
+
+    def __init__(self, ledger_path):
+        self.ledger_path = ledger_path
+
+        try:
+            with open(ledger_path) as ledger_file:
+                self.entries = json.load(ledger_file)
+        except FileNotFoundError:
+            self.entries = {}
+
+    # Offset the open source file has been processed up to, 0 if it needs to
+    # be processed from the start
+    def offset(self, source_file, stat, source, header):
+        entry = self.entries.get(str(source_file))
+
+        if entry is None or entry['inode'] != stat.st_ino or entry['offset'] > stat.st_size:
+            return 0
+
+        if entry.get('header') != fingerprint(header):
+            return 0
+
+        if entry.get('tail') != fingerprint(read_tail(source, entry['offset'])):
+            return 0
+
+        return entry['offset']
+
+    def last_timestamp(self, source_file):
+        return self.entries.get(str(source_file), {}).get('last_timestamp')
+
+    def update(self, source_file, stat, source, header, offset, last_timestamp=None):
+        self.entries[str(source_file)] = {
+            'offset': offset,
+            'inode': stat.st_ino,
+            'header': fingerprint(header),
+            'tail': fingerprint(read_tail(source, offset)),
+            'last_timestamp': last_timestamp,
+        }
+
+        self.save()
+
+    # Write to a temporary file first so a crash can't leave a half written
+    # ledger behind
+    def save(self):
+        ledger_dir = os.path.dirname(self.ledger_path)
+        if ledger_dir:
+            os.makedirs(ledger_dir, exist_ok=True)
+
+        temp_path = '%s.tmp' % (self.ledger_path)
+        with open(temp_path, 'w') as ledger_file:
+            json.dump(self.entries, ledger_file, indent=1)
+
+        os.replace(temp_path, self.ledger_path)
+
+def fingerprint(data):
+    return '%08x' % (zlib.crc32(data))
+
+def read_tail(source, offset):
+    start = max(0, offset - TAIL_LENGTH)
+    source.seek(start)
+
+    return source.read(offset - start)
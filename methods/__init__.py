@@ -0,0 +1,52 @@
+"""
+Split methods available to csv_slicer.py, selected with -m/--method as
+<method>:<argument>.
+
+A split method is a module in this package that provides one of:
+
+    bucket(prog_args, csv_data, method_arg, index_column)
+        Returns the (possibly re-indexed) DataFrame and an array with the
+        output file path of every row, rows with a path of None are dropped.
+
+    split_file(prog_args, source_file, method_arg, skip_rows, header_row)
+        Splits a source file on its own, without it being read into a
+        DataFrame first.
+
+Methods are only imported when they're used, so the dependencies of one
+method are never loaded by a run that uses another.  Modules dropped into
+this package are picked up under their own name without being registered.
+"""
+import importlib
+import numpy as np
+
+# Method names accepted on the command line and the modules implementing them
+SPLIT_METHODS = {
+    'date': 'methods.date',
+    'chunk': 'methods.chunk',
+    'value': 'methods.value',
+    'window': 'methods.time_window',
+}
+
+def load_method(name):
+    module_name = SPLIT_METHODS.get(name, '%s.%s' % (__name__, name))
+
+    try:
+        return importlib.import_module(module_name)
+    except ModuleNotFoundError as err:
+        # Only treat the method itself being missing as unknown, not a
+        # dependency of the method
+        if err.name != module_name:
+            raise
+
+        return None
+
+def is_streaming(method):
+    return hasattr(method, 'split_file')
+
+# Expand the output file names of factorized buckets back out to one per row, 
+# rows that didn't fall into a bucket (code -1, e.g. NaT) get None
+def take_names(codes, names):
+    log_files = np.full(len(codes), None, dtype=object)
+    log_files[codes >= 0] = names.take(codes[codes >= 0])
+
+    return log_files
@@ -0,0 +1,65 @@
+"""
+Splits a source file by an arbitrary number of rows.  Lines are copied from the 
+source file to the output files as raw bytes without being parsed, each output 
+file receives the header row followed by up to N rows of data.
+
+Output file names are built from the file name format, which may contain the 
+{source} (source file name without extension), {index} (zero-based number of 
+the output file) and {suffix} (source file extension) placeholders.
+
+NOTE: Rows are split on line endings, quoted values that contain line breaks 
+      are not supported.
+
+Example: chunk:100000
+"""
+import os
+from itertools import islice
+from pathlib import Path
+
+# Default output file name format
+CHUNK_FILENAME_FORMAT = '{source}_{index:04d}{suffix}'
+
+def split_file(prog_args, source_file, method_arg, skip_rows, header_row, buffer_size=1024 * 1024):
+    row_count = int(method_arg)
+    if row_count < 1:
+        raise ValueError("Number of rows per file must be at least 1: %s" % (prog_args.method))
+
+    name_format = CHUNK_FILENAME_FORMAT
+    if prog_args.filename_format:
+        name_format = prog_args.filename_format.strip()
+
+    file_path = '%s/%s' % (prog_args.output.strip(), name_format)
+    source_file = Path(source_file)
+
+    with open(source_file, 'rb', buffering=buffer_size) as source:
+        lines = iter(source)
+
+        # Drop the rows that come before the header, same as read_csv() does 
+        # with the skip rows and header row arguments
+        if isinstance(skip_rows, int):
+            lines = islice(lines, skip_rows, None)
+        elif skip_rows:
+            skip_rows = set(skip_rows)
+            lines = (line for line_number, line in enumerate(lines) if line_number not in skip_rows)
+
+        header = b''
+        if header_row is not None:
+            for header in islice(lines, header_row + 1):
+                pass
+
+        # Each pass of the loop takes the first row of the next output file, 
+        # the rest of that file's rows are copied straight from the iterator
+        for index, first_row in enumerate(lines):
+            log_file = file_path.format(source=source_file.stem, index=index, suffix=source_file.suffix)
+
+            # check output path and create directory paths that do not exist, 
+            # other workers may be creating the same directories
+            os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+            with open(log_file, 'wb', buffering=buffer_size) as output:
+                output.write(header)
+                output.write(first_row)
+                output.writelines(islice(lines, row_count - 1))
+
+            if prog_args.verbose:
+                print("Wrote %s" % (log_file))
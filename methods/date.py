@@ -0,0 +1,132 @@
+"""
+Splits data by date/time, rows are written to the file named by formatting 
+their timestamp with the file name format (-f/--filename_format).  Rows are 
+grouped by those file names alone, the method argument is a python date 
+formatting string that should match the date part of the file name format 
+and only a warning is printed when it splits by a finer unit of time.
+
+Example: date:%Y%m%d
+"""
+import re
+import numpy as np
+import pandas as pd
+from methods import take_names
+from timestamps import adjust_index
+
+# Set once the method argument mismatch has been reported, bucket() runs once 
+# per batch of rows
+warned_format = False
+
+def bucket(prog_args, csv_data, method_arg, index_column):
+    global warned_format
+
+    if not warned_format and finer_format(method_arg, prog_args.filename_format.strip()):
+        print("WARNING: Rows are grouped by the file name format '%s', which can't split them as finely as the date format '%s'." % (prog_args.filename_format.strip(), method_arg))
+        warned_format = True
+
+    csv_data = datetime_index(prog_args, csv_data, index_column)
+
+    # generate path names using output path and file name format arguments
+    file_path = '%s/%s' % (prog_args.output.strip(), prog_args.filename_format.strip())
+
+    # work out which data file every row belongs to in a single vectorized 
+    # pass, rows are grouped by their destination afterwards
+    return csv_data, format_buckets(csv_data.index, file_path)
+
+# Translate the index into date/time, adjusting timezones if requested
+def datetime_index(prog_args, csv_data, index_column):
+    # if index is not already a DateTimeIndex then recreate it as one
+    if not isinstance(csv_data.index, pd.DatetimeIndex):
+        # set index, necessary grouping rows by interval format
+        if index_column in csv_data.columns:
+            csv_data.set_index(index_column, inplace=True)
+
+        csv_data.index = pd.to_datetime(csv_data.index)
+
+    if prog_args.adjust_tz: # if datetime is not UTC adjust accordingly
+        csv_data.index = adjust_index(csv_data.index, prog_args.adjust_tz)
+
+    return csv_data
+
+# Finest unit of time each strftime directive can tell apart, anything not 
+# listed (e.g. %f, %z, %Z) requires formatting every timestamp individually
+STRFTIME_RESOLUTION = {
+    **dict.fromkeys('aAwdbhBmyYjUWGuVCgxDF', 'D'),
+    **dict.fromkeys('HIp', 'H'),
+    **dict.fromkeys('MR', 'min'),
+    **dict.fromkeys('STrXcs', 'S'),
+}
+RESOLUTION_ORDER = ['D', 'H', 'min', 'S']
+
+def strftime_resolution(name_format):
+    resolution = 'D'
+
+    for directive in re.findall(r'%[-_0^#]?(.)', name_format):
+        if directive == '%':
+            continue
+
+        directive_resolution = STRFTIME_RESOLUTION.get(directive)
+        if directive_resolution is None:
+            return None
+
+        resolution = max(resolution, directive_resolution, key=RESOLUTION_ORDER.index)
+
+    return resolution
+
+# Units of time coarser than a day, only needed to compare formats with each 
+# other.  A format without any directives doesn't split timestamps at all.
+CALENDAR_RESOLUTION = {
+    **dict.fromkeys('YyCG', 'Y'),
+    **dict.fromkeys('mbBh', 'M'),
+    **dict.fromkeys('UWV', 'W'),
+}
+CALENDAR_ORDER = ['', 'Y', 'M', 'W'] + RESOLUTION_ORDER
+
+def calendar_resolution(name_format):
+    resolution = ''
+
+    for directive in re.findall(r'%[-_0^#]?(.)', name_format):
+        if directive == '%':
+            continue
+
+        directive_resolution = CALENDAR_RESOLUTION.get(directive) or STRFTIME_RESOLUTION.get(directive)
+        if directive_resolution is None:
+            return None
+
+        resolution = max(resolution, directive_resolution, key=CALENDAR_ORDER.index)
+
+    return resolution
+
+# Whether date_format tells apart timestamps that name_format doesn't, only 
+# known when both are made up of directives listed above
+def finer_format(date_format, name_format):
+    date_resolution = calendar_resolution(date_format)
+    name_resolution = calendar_resolution(name_format)
+
+    if date_resolution is None or name_resolution is None:
+        return False
+
+    return CALENDAR_ORDER.index(date_resolution) > CALENDAR_ORDER.index(name_resolution)
+
+# Format every timestamp of a DatetimeIndex with name_format.  Timestamps are 
+# first reduced to the coarsest resolution the format can distinguish so that 
+# strftime only runs once per distinct bucket rather than once per row.
+def format_buckets(index, name_format):
+    resolution = strftime_resolution(name_format)
+    if resolution is None:
+        return np.asarray(index.strftime(name_format), dtype=object)
+
+    # Bucket on local wall-clock time, which is what strftime formats
+    if index.tz is not None:
+        index = index.tz_localize(None)
+
+    if resolution == 'D':
+        buckets = index.normalize()
+    else:
+        buckets = index.floor(resolution)
+
+    codes, uniques = pd.factorize(buckets)
+    names = np.asarray(uniques.strftime(name_format), dtype=object)
+
+    return take_names(codes, names)
+
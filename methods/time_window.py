@@ -0,0 +1,29 @@
+"""
+Splits data into fixed length windows of time, the method argument is a pandas 
+frequency string and each window is written to the file named by formatting 
+the start of the window with the file name format.
+
+Windows of timezone aware data follow local wall-clock time, because of this 
+the %z and %Z directives aren't available in the file name format.
+
+Example: window:6H
+"""
+import numpy as np
+import pandas as pd
+from methods import take_names
+from methods.date import datetime_index
+
+def bucket(prog_args, csv_data, method_arg, index_column):
+    csv_data = datetime_index(prog_args, csv_data, index_column)
+
+    # generate path names using output path and file name format arguments
+    file_path = '%s/%s' % (prog_args.output.strip(), prog_args.filename_format.strip())
+
+    index = csv_data.index
+    if index.tz is not None:
+        index = index.tz_localize(None)
+
+    codes, uniques = pd.factorize(index.floor(method_arg))
+    names = np.asarray(uniques.strftime(file_path), dtype=object)
+
+    return csv_data, take_names(codes, names)
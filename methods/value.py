@@ -0,0 +1,31 @@
+"""
+Splits data by the unique values of a column, rows are written to the file 
+named by substituting the value into the {value} placeholder of the file name 
+format.
+
+Example: value:station
+"""
+import numpy as np
+import pandas as pd
+from methods import take_names
+
+# Default output file name format
+VALUE_FILENAME_FORMAT = '{value}.csv'
+
+def bucket(prog_args, csv_data, method_arg, index_column):
+    name_format = VALUE_FILENAME_FORMAT
+    if prog_args.filename_format:
+        name_format = prog_args.filename_format.strip()
+
+    file_path = '%s/%s' % (prog_args.output.strip(), name_format)
+
+    if method_arg == csv_data.index.name:
+        values = csv_data.index
+    else:
+        values = csv_data[method_arg]
+
+    # Only format a file name once for each unique value
+    codes, uniques = pd.factorize(values)
+    names = np.asarray([file_path.format(value=value) for value in uniques], dtype=object)
+
+    return csv_data, take_names(codes, names)
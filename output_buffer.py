@@ -0,0 +1,94 @@
+"""
+Buffers the rows headed for each output file across all the source files of
+a run, so every output file is written once at the end rather than once per
+source file that has rows for it.
+
+Rows are kept in memory up to a budget, past it the destination holding the
+most rows in memory is spilled to a pickle file in a temporary directory and
+read back when the buffer is flushed.
+"""
+import os
+import tempfile
+import pandas as pd
+
+class OutputBuffer:
+    """
+    Slices of data collected per output file, in the order they were added.
+    Also counts how many source files contributed to each output file.
+    """
+
+    def __init__(self, memory_budget, temp_dir=None):
+        self.memory_budget = memory_budget
+        self.temp_dir = temp_dir
+        self.spill_dir = None
+        self.memory_used = 0
+        self.source_count = 0
+
+        # Per output file: in-memory slices, their size, spill files, the
+        # number of sources and the last source seen
+        self.frames = {}
+        self.frame_sizes = {}
+        self.spill_files = {}
+        self.sources = {}
+        self.last_source = {}
+
+    # Add the batches of (output file, DataFrame) pairs read from one source
+    # file
+    def add_source(self, source_slices):
+        self.source_count += 1
+
+        for slices in source_slices:
+            for log_file, df_slice in slices:
+                self.add(log_file, df_slice)
+
+    def add(self, log_file, df_slice):
+        if log_file not in self.frames:
+            self.frames[log_file] = []
+            self.frame_sizes[log_file] = 0
+            self.spill_files[log_file] = []
+            self.sources[log_file] = 0
+
+        if self.last_source.get(log_file) != self.source_count:
+            self.last_source[log_file] = self.source_count
+            self.sources[log_file] += 1
+
+        size = int(df_slice.memory_usage(deep=True).sum())
+
+        self.frames[log_file].append(df_slice)
+        self.frame_sizes[log_file] += size
+        self.memory_used += size
+
+        while self.memory_used > self.memory_budget:
+            self.spill(max(self.frame_sizes, key=self.frame_sizes.get))
+
+    def spill(self, log_file):
+        if self.spill_dir is None:
+            self.spill_dir = tempfile.TemporaryDirectory(prefix="csv_slicer_", dir=self.temp_dir)
+
+        spill_file = os.path.join(self.spill_dir.name, "spill_%06d.pkl" % (sum(map(len, self.spill_files.values()))))
+        pd.concat(self.frames[log_file]).to_pickle(spill_file)
+
+        self.spill_files[log_file].append(spill_file)
+        self.memory_used -= self.frame_sizes[log_file]
+        self.frames[log_file] = []
+        self.frame_sizes[log_file] = 0
+
+    # Yields every output file with all of its rows, in the order they were
+    # added, and the number of source files they came from.  Spilled rows are
+    # read back one output file at a time.
+    def destinations(self):
+        try:
+            for log_file in list(self.frames):
+                frames = [pd.read_pickle(spill_file) for spill_file in self.spill_files.pop(log_file)]
+                frames.extend(self.frames.pop(log_file))
+
+                self.memory_used -= self.frame_sizes.pop(log_file)
+
+                yield log_file, pd.concat(frames), self.sources[log_file]
+        finally:
+            self.close()
+
+    def close(self):
+        if self.spill_dir is not None:
+            self.spill_dir.cleanup()
+            self.spill_dir = None
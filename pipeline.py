@@ -0,0 +1,164 @@
+"""
+Chains the scripts together as stages of a single pipeline that hands
+DataFrames from one stage to the next in memory, so the source is parsed once
+and only the final outputs are written, rather than every script writing
+intermediate CSV files for the next one to parse again.
+
+Each stage is configured with the same options as its script, built from the
+script's command line arguments with options().  Stages pass along a stream
+of (name, DataFrame) pairs: partitions are named after their partition value,
+slices after the output file they belong in and merges after their output
+path.
+
+Example, partition a Campbell Scientific file, parse the timestamps of every
+message type and slice them into daily files per message type:
+
+    import csv_partition, csv_convert_date, csv_slicer
+    from pipeline import options, run, read_partitions, convert_dates, slice_frames, write_slices
+
+    run(
+        read_partitions(options(csv_partition, "logger.dat", "-s", "&", "-l", labels)),
+        convert_dates(options(csv_convert_date, "-", "-c", "timestamp", "-i", "%Y-%m-%d %H:%M")),
+        slice_frames(options(csv_slicer, "-", "-o", "output/{name}", "-c", "timestamp", "-f", "%Y%m%d.csv")),
+        write_slices(options(csv_slicer, "-", "-o", "output/{name}", "-c", "timestamp")),
+    )
+
+NOTE: Stages that take their input from the previous stage ignore the source
+argument of their options, it's still required so "-" can be given instead.
+Partitions are passed on as the text they were split into, values are not
+re-formatted by a round trip through a CSV file.  The -t/--timestamp option
+of csv_convert_date.py only applies when reading source files.
+"""
+import os
+import argparse
+from pathlib import Path
+import csv_slicer
+import csv_partition
+import csv_convert_date
+import csv_merge
+
+# Build the options of a stage from the command line arguments of its script,
+# keyword arguments override individual options afterwards
+def options(script, *args, **overrides):
+    prog_args = script.build_parser().parse_args([str(arg) for arg in args])
+
+    for name, value in overrides.items():
+        setattr(prog_args, name, value)
+
+    return prog_args
+
+# Run the stages in order, feeding each one the output of the one before it,
+# and return the (name, DataFrame) pairs produced by the last stage
+def run(*stages):
+    frames = iter(())
+
+    for stage in stages:
+        frames = stage(frames)
+
+    return list(frames)
+
+# Source stage, partitions the source file of csv_partition.py options into a
+# DataFrame per partition
+def read_partitions(prog_args):
+    def stage(frames):
+        yield from frames
+
+        with open(prog_args.source_file.strip(), "r") as source:
+            partitions = csv_partition.partition_frames(
+                prog_args, source,
+                csv_partition.parse_formats(prog_args),
+                csv_partition.parse_labels(prog_args),
+            )
+
+        yield from partitions.items()
+
+    return stage
+
+# Source stage, reads every source file matched by csv_convert_date.py
+# options the same way the script does, named after the source file
+def read_sources(prog_args):
+    def stage(frames):
+        yield from frames
+
+        for source_file in source_files(prog_args.source_file):
+            yield str(source_file), csv_convert_date.read_source(prog_args, source_file)
+
+    return stage
+
+# Parse the timestamp column of every DataFrame with csv_convert_date.py
+# options
+def convert_dates(prog_args):
+    def stage(frames):
+        for name, csv_data in frames:
+            yield name, csv_convert_date.convert_data(prog_args, csv_data)
+
+    return stage
+
+# Slice every DataFrame into the rows that belong in each output file with
+# csv_slicer.py options.  A {name} placeholder in the output directory is
+# replaced with the name of the DataFrame, so e.g. each partition can be
+# sliced into a directory of its own.
+def slice_frames(prog_args):
+    def stage(frames):
+        for name, csv_data in frames:
+            frame_args = named_options(prog_args, name)
+            _, rename_index = csv_slicer.parse_index_column(frame_args)
+
+            csv_data = csv_slicer.index_data(frame_args, csv_data)
+            csv_data = csv_slicer.prepare_data(frame_args, csv_data, rename_index)
+
+            yield from csv_slicer.slice_data(frame_args, csv_data)
+
+    return stage
+
+# Write slices to their output files with csv_slicer.py options, merging them
+# into existing files.  The slices are passed on afterwards.
+def write_slices(prog_args):
+    def stage(frames):
+        slices = list(frames)
+
+        csv_slicer.write_slices(prog_args, slices)
+
+        return iter(slices)
+
+    return stage
+
+# Merge all the DataFrames into one with csv_merge.py options, named after
+# the merge's output path
+def merge(prog_args):
+    def stage(frames):
+        source_dfs = [csv_data for _, csv_data in frames]
+
+        # Headers from the first DataFrame are used for all of them
+        for csv_data in source_dfs[1:]:
+            csv_data.columns = source_dfs[0].columns
+
+        yield csv_merge.output_file_path(prog_args), csv_merge.merge_frames(prog_args, source_dfs)
+
+    return stage
+
+# Write every DataFrame to the file it's named after.  The DataFrames are
+# passed on afterwards.
+def write_csv(**to_csv_args):
+    def stage(frames):
+        for name, csv_data in frames:
+            # check output path and create directory paths that do not exist
+            if os.path.dirname(name) and not Path(os.path.dirname(name)).exists():
+                os.makedirs(os.path.dirname(name))
+
+            csv_data.to_csv(name, **to_csv_args)
+
+            yield name, csv_data
+
+    return stage
+
+def source_files(file_source):
+    file_source = file_source.strip()
+
+    return Path(os.path.dirname(file_source)).glob(os.path.basename(file_source))
+
+def named_options(prog_args, name):
+    if "{name}" not in prog_args.output:
+        return prog_args
+
+    return argparse.Namespace(**{**vars(prog_args), "output": prog_args.output.replace("{name}", str(name))})
@@ -0,0 +1,180 @@
+"""
+Runs a batch of jobs for the scripts, described in a YAML or JSON config
+file, from a single long-running process.  pandas and the scripts are only
+imported once and jobs are spread over a pool of worker processes, rather
+than every job starting a Python process of its own.
+
+Each job names the script to run and either the same command line arguments
+the script accepts or a mapping of its options, keyed by the option's long
+name (with or without leading dashes) or its destination name:
+
+    workers: 4
+    jobs:
+      - name: station_1
+        script: csv_slicer
+        args: ["data/station_1/*.csv", "-o", "sliced/station_1", "-f", "%Y%m%d.csv"]
+      - name: station_2
+        script: csv_slicer
+        options:
+          source_file: data/station_2/*.csv
+          output: sliced/station_2
+          filename_format: "%Y%m%d.csv"
+          dedup-index: true
+
+Every job's options are checked before any of them run.  Jobs run at the
+same time must not write to the same output files.
+
+NOTE: YAML config files require PyYAML to be installed, JSON does not.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import csv_slicer
+import csv_partition
+import csv_convert_date
+import csv_merge
+
+SCRIPTS = {
+    'csv_slicer': csv_slicer,
+    'csv_partition': csv_partition,
+    'csv_convert_date': csv_convert_date,
+    'csv_merge': csv_merge,
+}
+
+def main(prog_args):
+    config = load_config(prog_args.config)
+
+    workers = prog_args.workers or config.get('workers', 1)
+
+    # Build every job's options up front so a mistake in the config stops the
+    # run before anything has been written
+    jobs = []
+    for position, job in enumerate(config.get('jobs', [])):
+        name = job.get('name', '%s #%d' % (job.get('script'), position + 1))
+
+        try:
+            jobs.append((name, job_script(job), job_options(job)))
+        except (KeyError, ValueError, SystemExit) as err:
+            sys.exit("Invalid job %s: %s" % (name, err))
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(run_job, jobs))
+    else:
+        results = [run_job(job) for job in jobs]
+
+    failed = [name for name, succeeded in results if not succeeded]
+    if failed:
+        sys.exit("Failed jobs: %s" % (", ".join(failed)))
+
+def load_config(config_path):
+    with open(config_path) as config_file:
+        if os.path.splitext(config_path)[1].lower() in ('.yaml', '.yml'):
+            import yaml
+
+            return yaml.safe_load(config_file)
+
+        return json.load(config_file)
+
+def job_script(job):
+    script_name = os.path.splitext(job['script'])[0]
+
+    if script_name not in SCRIPTS:
+        raise ValueError("unknown script %s, expected one of: %s" % (job['script'], ", ".join(SCRIPTS)))
+
+    return script_name
+
+# Parse a job's options with its script's own command line parser, so jobs
+# get exactly the same defaults and checks as running the script
+def job_options(job):
+    parser = SCRIPTS[job_script(job)].build_parser()
+
+    if 'options' in job:
+        args = option_args(parser, job['options'])
+    else:
+        args = [str(arg) for arg in job.get('args', [])]
+
+    return parser.parse_args(args)
+
+# Turn a mapping of options into command line arguments for the parser
+def option_args(parser, options):
+    positionals = {action.dest: action for action in parser._actions if not action.option_strings}
+    flags = {}
+    for action in parser._actions:
+        flags[action.dest] = action
+        for option_string in action.option_strings:
+            flags[option_string.lstrip('-')] = action
+
+    args = []
+    positional_args = []
+
+    for key, value in options.items():
+        key = key.lstrip('-')
+
+        if key in positionals:
+            values = value if isinstance(value, list) else [value]
+            positional_args.extend(str(item) for item in values)
+            continue
+
+        if key not in flags:
+            raise ValueError("unknown option %s" % (key))
+
+        option_string = flags[key].option_strings[-1]
+
+        # Switches are included when true and left out when false
+        if flags[key].nargs == 0:
+            if value:
+                args.append(option_string)
+        elif isinstance(value, list):
+            args.append(option_string)
+            args.extend(str(item) for item in value)
+        elif isinstance(value, dict):
+            args.extend([option_string, json.dumps(value)])
+        elif value is not None:
+            args.extend([option_string, str(value)])
+
+    # Positionals go last so they can't be taken for values of an option
+    # that accepts several
+    return args + ['--'] + positional_args if positional_args else args
+
+# Run a single job, returns its name and whether it succeeded.  A failing job
+# is reported and doesn't stop the others.
+def run_job(job):
+    name, script_name, prog_args = job
+
+    start_time = time.perf_counter()
+
+    try:
+        SCRIPTS[script_name].main(prog_args)
+    except Exception:
+        print("Job %s failed:" % (name), file=sys.stderr)
+        traceback.print_exc()
+        return name, False
+
+    print("Job %s finished in %.3f s" % (name, time.perf_counter() - start_time))
+
+    return name, True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument(
+        "config",
+        help="YAML (.yaml/.yml) or JSON config file listing the jobs to run",
+        action="store",
+    )
+
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes jobs are spread over, overrides the workers setting of the config file, default: 1",
+        type=int,
+        action="store",
+    )
+
+    prog_args = parser.parse_args()
+
+    main(prog_args)
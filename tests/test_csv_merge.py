@@ -0,0 +1,39 @@
+import csv_merge
+
+def merge(*args):
+    prog_args = csv_merge.build_parser().parse_args([str(arg) for arg in args])
+    csv_merge.main(prog_args)
+
+def write_rows(path, rows):
+    path.write_text("".join("%s\n" % (row) for row in ["timestamp,value"] + rows))
+
+# Merging overlapping windows into an indexed output file gives the same file 
+# as merging everything at once, whether the new rows are appended or merged
+def test_dedup_index_matches_full_merge(tmp_path):
+    first, second, third = tmp_path / "first.csv", tmp_path / "second.csv", tmp_path / "third.csv"
+    write_rows(first, ["2021-01-01T00:00:01,1", "2021-01-01T00:00:02,2"])
+    write_rows(second, ["2021-01-01T00:00:02,2", "2021-01-01T00:00:03,3"])
+    write_rows(third, ["2021-01-01T00:00:00,0", "2021-01-01T00:00:04,4"])
+
+    merge(first, second, third, "-o", tmp_path / "all.csv")
+
+    indexed = tmp_path / "indexed.csv"
+    merge(first, "-o", indexed, "--dedup-index")
+    merge(second, "-o", indexed, "--dedup-index")
+    merge(third, "-o", indexed, "--dedup-index")
+
+    assert indexed.read_text() == (tmp_path / "all.csv").read_text()
+
+# Runs of an external sort are read with the column types of all the files, a 
+# blank in one run doesn't change how the values of the others are written or 
+# de-duplicated
+def test_run_size_matches_in_memory_merge(tmp_path):
+    first, second = tmp_path / "first.csv", tmp_path / "second.csv"
+    first.write_text("t,id,v\n1,1,a\n2,,b\n3,1,c\n4,2,d\n")
+    second.write_text("t,id,v\n5,3,e\n0,2,f\n6,10,g\n")
+
+    for options in [[], ["-c", 1], ["-c", 1, "-s", "1,DESC"]]:
+        merge(first, second, "-o", tmp_path / "memory.csv", *options)
+        merge(first, second, "-o", tmp_path / "runs.csv", "--run-size", 2, *options)
+
+        assert (tmp_path / "runs.csv").read_text() == (tmp_path / "memory.csv").read_text()
@@ -0,0 +1,111 @@
+import pandas as pd
+import csv_slicer
+
+def slice_file(*args):
+    prog_args = csv_slicer.build_parser().parse_args([str(arg) for arg in args])
+    csv_slicer.main(prog_args)
+
+# Numeric index columns are kept as they are rather than read as epoch 
+# timestamps, also when merging into existing output files
+def test_value_split_keeps_numeric_index(tmp_path):
+    source = tmp_path / "ids.csv"
+    source.write_text("id,station,v\n1,A,1.5\n2,B,2.5\n3,A,3.5\n")
+    output = tmp_path / "out"
+
+    slice_file(source, "-o", output, "-m", "value:station")
+
+    assert (output / "A.csv").read_text() == "id,station,v\n1,A,1.5\n3,A,3.5\n"
+    assert (output / "B.csv").read_text() == "id,station,v\n2,B,2.5\n"
+
+    source.write_text("id,station,v\n4,A,4.5\n")
+    slice_file(source, "-o", output, "-m", "value:station")
+
+    assert (output / "A.csv").read_text() == "id,station,v\n1,A,1.5\n3,A,3.5\n4,A,4.5\n"
+
+# Frames handed over by pipeline.py are indexed the same way
+def test_index_data_keeps_numeric_index():
+    prog_args = csv_slicer.build_parser().parse_args(["frames.csv", "-m", "value:station"])
+    csv_data = pd.DataFrame({"id": [1, 2], "station": ["A", "B"]})
+
+    assert list(csv_slicer.index_data(prog_args, csv_data).index) == [1, 2]
+
+# Rows already in an output file with a non-timestamp index are dropped by 
+# their hashed keys
+def test_dedup_index_with_text_index(tmp_path):
+    source = tmp_path / "values.csv"
+    source.write_text("t,station,v\na,A,1\nb,B,2\n")
+    output = tmp_path / "out"
+
+    slice_file(source, "-o", output, "-c", "t", "-m", "value:station", "--dedup-index")
+
+    source.write_text("t,station,v\na,A,1\nc,A,3\n")
+    slice_file(source, "-o", output, "-c", "t", "-m", "value:station", "--dedup-index")
+
+    assert (output / "A.csv").read_text() == "t,station,v\na,A,1\nc,A,3\n"
+
+# A blank value in a later batch makes an integer column floats in every 
+# batch, the same as loading the whole file
+def test_chunksize_matches_full_load(tmp_path):
+    rows = ["timestamp,a,s"]
+    for minute in range(30):
+        rows.append("2021-01-01 00:%02d:00,%s,%s" % (minute, "" if minute == 25 else minute, "x" if minute < 20 else ""))
+
+    source = tmp_path / "blank.csv"
+    source.write_text("\n".join(rows) + "\n")
+
+    slice_file(source, "-o", tmp_path / "full", "-f", "%Y%m%d")
+    slice_file(source, "-o", tmp_path / "chunked", "-f", "%Y%m%d", "--chunksize", 10)
+
+    assert (tmp_path / "chunked" / "20210101").read_text() == (tmp_path / "full" / "20210101").read_text()
+
+# Rows of later batches that come before the end of an output file created by 
+# an earlier batch are merged into it without dropping repeated timestamps, 
+# the same as loading the whole file
+def test_chunksize_keeps_out_of_order_duplicates(tmp_path):
+    rows = ["timestamp,a"]
+    for row, minute in enumerate([3, 1, 2, 1, 0, 2, 5, 4, 4, 0]):
+        rows.append("2021-01-01 00:%02d:00,%d" % (minute, row))
+
+    source = tmp_path / "unordered.csv"
+    source.write_text("\n".join(rows) + "\n")
+
+    slice_file(source, "-o", tmp_path / "full", "-f", "%Y%m%d")
+    slice_file(source, "-o", tmp_path / "chunked", "-f", "%Y%m%d", "--chunksize", 3)
+
+    full = (tmp_path / "full" / "20210101").read_text()
+
+    assert len(full.splitlines()) == len(rows)
+    assert (tmp_path / "chunked" / "20210101").read_text() == full
+
+# Byte ranges parsed in parallel are read with the column types of the whole 
+# file, and later ranges are merged into the output files without dropping 
+# repeated timestamps
+def test_shard_size_matches_serial(tmp_path):
+    rows = ["timestamp,a"]
+    for row in range(70000):
+        rows.append("2021-01-01 %02d:%02d:00,%s" % (row % 1440 // 60, row % 60, "" if row == 65000 else row))
+
+    source = tmp_path / "large.csv"
+    source.write_text("\n".join(rows) + "\n")
+
+    slice_file(source, "-o", tmp_path / "serial", "-f", "%Y%m%d")
+    slice_file(source, "-o", tmp_path / "sharded", "-f", "%Y%m%d", "--workers", 2, "--shard-size", 1)
+
+    assert (tmp_path / "sharded" / "20210101").read_text() == (tmp_path / "serial" / "20210101").read_text()
+
+# The last timestamp of an output file is read with --date-format-out, rows 
+# that come before it are merged rather than appended out of order
+def test_incremental_reads_date_format_out(tmp_path):
+    source = tmp_path / "day.csv"
+    output = tmp_path / "out"
+    options = ["-o", output, "-f", "%Y%m", "--incremental", "--date-format-out", "%d/%m/%Y %H:%M"]
+
+    source.write_text("timestamp,v\n2021-03-01 08:00,1\n2021-03-01 10:00,2\n")
+    slice_file(source, *options)
+
+    source.write_text("timestamp,v\n2021-03-01 09:00,3\n")
+    slice_file(source, *options)
+
+    assert (output / "202103").read_text() == (
+        "timestamp,v\n01/03/2021 08:00,1\n01/03/2021 09:00,3\n01/03/2021 10:00,2\n"
+    )
@@ -0,0 +1,45 @@
+"""
+Timestamp normalization shared by csv_slicer.py and csv_convert_date.py.
+
+--adjust-tz is given as <hours>:<timezone>.  Timezone naive timestamps are
+shifted by the hours and localized to the timezone, timestamps that are
+already timezone aware are converted to it instead.  The shift is done on
+the int64 nanoseconds behind the timestamps and the parsed option is cached,
+so every file with the same option reuses the same offset and tz object.
+"""
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+NAT_NS = np.iinfo(np.int64).min
+
+# Parse an --adjust-tz option into the offset in nanoseconds and the tz object
+# of the timezone
+@lru_cache(maxsize=None)
+def parse_adjust_tz(adjust_tz):
+    adjust_hours, destination_tz = adjust_tz.strip().split(":")
+
+    offset_ns = int(round(float(adjust_hours) * 3600 * 10**9))
+    tz = pd.DatetimeIndex([], tz=destination_tz).tz
+
+    return offset_ns, tz
+
+# Apply an --adjust-tz option to a DatetimeIndex
+def adjust_index(index, adjust_tz):
+    offset_ns, tz = parse_adjust_tz(adjust_tz)
+
+    if index.tz is not None:
+        return index.tz_convert(tz)
+
+    return shift_index(index, offset_ns).tz_localize(tz)
+
+# Shift a timezone naive DatetimeIndex by a number of nanoseconds, NaT stays
+# NaT
+def shift_index(index, offset_ns):
+    if offset_ns == 0:
+        return index
+
+    values = index.asi8
+    shifted = np.where(values == NAT_NS, NAT_NS, values + offset_ns)
+
+    return pd.DatetimeIndex(shifted.view('M8[ns]'), name=index.name)
@@ -0,0 +1,87 @@
+"""
+Waits for files in a directory to change.  On Linux the directory is watched
+with inotify, called through libc so nothing needs to be installed, anywhere
+else (or if inotify can't be set up) the directory is polled instead.
+"""
+import os
+import time
+import ctypes
+import ctypes.util
+import select
+import struct
+
+# inotify event flags, from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+
+# struct inotify_event is followed by a NUL padded name of len bytes
+EVENT_HEADER = struct.Struct('iIII')
+
+# Yields the names of the files in the directory that changed since the last
+# time, or None when any of them may have changed (every poll, or when events
+# were lost).  Yields None once right away so existing files are picked up.
+def watch_directory(directory, interval=1.0):
+    yield None
+
+    inotify_fd = inotify_watch(directory)
+
+    if inotify_fd is None:
+        while True:
+            time.sleep(interval)
+            yield None
+
+    try:
+        while True:
+            readable, _, _ = select.select([inotify_fd], [], [], interval)
+            if readable:
+                yield read_events(inotify_fd)
+    finally:
+        os.close(inotify_fd)
+
+# Returns an inotify file descriptor watching the directory, or None if
+# inotify isn't available
+def inotify_watch(directory):
+    libc_name = ctypes.util.find_library('c')
+    if libc_name is None:
+        return None
+
+    libc = ctypes.CDLL(libc_name, use_errno=True)
+    if not hasattr(libc, 'inotify_init1'):
+        return None
+
+    inotify_fd = libc.inotify_init1(IN_CLOEXEC)
+    if inotify_fd < 0:
+        return None
+
+    if libc.inotify_add_watch(inotify_fd, os.fsencode(directory or '.'), WATCH_MASK) < 0:
+        os.close(inotify_fd)
+        return None
+
+    return inotify_fd
+
+def read_events(inotify_fd, buffer_size=64 * 1024):
+    data = os.read(inotify_fd, buffer_size)
+
+    names = set()
+    position = 0
+
+    while position + EVENT_HEADER.size <= len(data):
+        _, mask, _, name_length = EVENT_HEADER.unpack_from(data, position)
+        position += EVENT_HEADER.size
+
+        if mask & IN_Q_OVERFLOW:
+            return None
+
+        name = data[position:position + name_length].rstrip(b'\0')
+        position += name_length
+
+        if name:
+            names.add(os.fsdecode(name))
+
+    return names